@@ -1,9 +1,13 @@
 from qg.logger import logger
 
 from dynaconf import settings
-from qg.bot import QGBot
+from qg.bot import Cluster, QGBot, configure_logging
 
 
 if __name__ == "__main__":
-    bot = QGBot(settings.BOT.token)
-    bot.run(websocket=settings.BOT.ws_enabled)
+    configure_logging()
+    if settings.BOT.processes > 1:
+        Cluster(settings.BOT.token, settings.BOT.processes).run(websocket=settings.BOT.ws_enabled)
+    else:
+        bot = QGBot(settings.BOT.token)
+        bot.run(websocket=settings.BOT.ws_enabled)
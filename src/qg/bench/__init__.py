@@ -0,0 +1,7 @@
+'''
+Replay benchmark of the update handlers.
+
+Feeds recorded or synthetic updates through the real dispatcher of `QGBot`, connected to a local
+database and a stub of the Bot API, and reports the throughput, the latency percentiles per handler
+and the number of SQL statements per update. See `python -m qg.bench --help`.
+'''
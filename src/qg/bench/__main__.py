@@ -0,0 +1,73 @@
+import argparse
+import itertools
+import json
+import time
+
+from dynaconf import settings
+
+parser = argparse.ArgumentParser(
+    prog='python -m qg.bench',
+    description='Replay the updates through the bot against a local database and a stub of the Bot API.'
+)
+parser.add_argument('--db', help='database URI (a scratch database is recommended), the settings are used otherwise')
+parser.add_argument('--updates', help='file with an update JSON per line, synthetic updates are generated otherwise')
+parser.add_argument('--count', type=int, default=5000, help='number of synthetic updates (default: %(default)s)')
+parser.add_argument('--users', type=int, default=1000, help='number of synthetic users (default: %(default)s)')
+parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic updates (default: %(default)s)')
+parser.add_argument('--record', help='save the synthetic updates to this file')
+parser.add_argument('--latency', type=float, default=0.0, help='latency of the stub Bot API in ms (default: none)')
+parser.add_argument('--json', action='store_true', help='print the report as JSON')
+args = parser.parse_args()
+
+# the handlers are measured by the replay in the dispatcher's thread, and the outbox mustn't hold back the stub
+settings.set('BOT.workers', 0)
+settings.set('BOT.asyncio', False)
+settings.set('BOT.metrics_port', None)
+# the synthetic (and the recorded) updates are numbered the same way on every run, so they would be dropped
+# as the duplicates of the previous one
+settings.set('BOT.dedupe.enabled', False)
+settings.set('BOT.outbox.global_rate', 1_000_000)
+settings.set('BOT.outbox.chat_rate', 1_000_000)
+settings.set('BOT.outbox.chat_burst', 1_000_000)
+settings.set('BOT.owner', settings.BOT.get('owner', 1))
+settings.set('PAYMENT.stripe_token', settings.get('PAYMENT', {}).get('stripe_token', 'bench'))
+settings.set('DB.admins', settings.DB.get('admins', []))
+settings.set('DB.categories', settings.DB.get('categories', []))
+if args.db:
+    settings.set('DB.FULL_URI', args.db)
+
+from qg.bot.bot import QGBot  # noqa: E402 (the settings have to be in place first)
+from qg.logger import configure as configure_logger  # noqa: E402
+
+from .replay import Replay, format_report  # noqa: E402
+from .stub import stub_bot  # noqa: E402
+from .synthetic import generate  # noqa: E402
+
+configure_logger(console_level='WARNING', enqueue=False)
+
+qgbot = QGBot(bot=stub_bot(args.latency / 1000))
+qgbot.updater.job_queue.start()
+
+if args.updates:
+    with open(args.updates) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+else:
+    categories = list(qgbot.db.get_categories())
+    if not categories:
+        with qgbot.db.session():
+            qgbot.db.add_category('bench', 'Benchmark', 'https://example.com')
+        categories = ['bench']
+    synthetic = generate(args.count, categories, args.users, args.seed, prefix=f'bench-{int(time.time())}')
+    updates = list(itertools.islice(synthetic, args.count))
+    if args.record:
+        with open(args.record, 'w') as f:
+            f.writelines(json.dumps(update) + '\n' for update in updates)
+
+try:
+    report = Replay(qgbot).run(updates)
+finally:
+    qgbot.updater.job_queue.stop()
+    qgbot.workers.shutdown()
+    qgbot.outbox.stop()
+
+print(json.dumps(report, indent=2) if args.json else format_report(report))
@@ -0,0 +1,131 @@
+'''
+A local stand-in for the Telegram Bot API for the end-to-end load tests.
+
+    python -m qg.bench.fakeapi [--port 8081] [--latency 50] [--retry-after-probability 0.01]
+
+Point the bot at it with the `bot.api_url` setting (e.g. `http://localhost:8081/bot`).
+Every call is answered with a plausible result after the given latency, or with
+429 Too Many Requests at the given probability. The server records the calls:
+`GET /stats` returns the number of calls per method, `GET /answers` returns the time
+when each inline query, callback query and pre-checkout query was answered
+(so that the load generator can measure the end-to-end latency).
+'''
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from .stub import fake_result
+
+# the methods which answer an update, by the name of the id of the update
+ANSWERS = {
+    'answerInlineQuery': 'inline_query_id',
+    'answerCallbackQuery': 'callback_query_id',
+    'answerPreCheckoutQuery': 'pre_checkout_query_id'
+}
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, retry_after_probability: float = 0.0, retry_after: int = 1):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.retry_after_probability = retry_after_probability
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.rejected = Counter()
+        self.answers = {}
+        self.message_ids = itertools.count(1)
+
+    def call(self, method: str, data: dict):
+        '''Returns the HTTP status and the response'''
+        if self.latency:
+            time.sleep(self.latency)
+
+        if random.random() < self.retry_after_probability:
+            with self.lock:
+                self.rejected[method] += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }
+
+        with self.lock:
+            self.calls[method] += 1
+            if (id_field := ANSWERS.get(method)) and id_field in data:
+                self.answers[str(data[id_field])] = time.time()
+            result = fake_result(method, data, self.message_ids)
+        return 200, {'ok': True, 'result': result}
+
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(self.calls), 'rejected': dict(self.rejected), 'answered': len(self.answers)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            data = json.loads(body or b'{}')
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            data = dict(parse_qsl(body.decode()))
+        else:
+            data = {}  # e.g. the files, nobody cares about the content
+
+        # /bot<token>/<method>
+        self._reply(*self.server.call(self.path.rsplit('/', 1)[-1], data))
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.stats())
+        elif self.path == '/answers':
+            with self.server.lock:
+                self._reply(200, dict(self.server.answers))
+        else:
+            self._reply(*self.server.call(self.path.rsplit('/', 1)[-1].split('?')[0], {}))
+
+    def _reply(self, status, response):
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m qg.bench.fakeapi', description='A local stand-in for the Bot API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of every call in ms (default: none)')
+    parser.add_argument('--retry-after-probability', type=float, default=0.0,
+                        help='probability of answering 429 Too Many Requests (default: %(default)s)')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after of the 429s in seconds (default: %(default)s)')
+    args = parser.parse_args()
+
+    server = FakeBotAPI((args.host, args.port), args.latency / 1000, args.retry_after_probability, args.retry_after)
+    print(f'The fake Bot API is listening on http://{args.host}:{args.port}/bot<token>/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
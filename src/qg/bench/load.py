@@ -0,0 +1,122 @@
+'''
+Load generator for the webhook of a running bot.
+
+    python -m qg.bench.load --webhook http://localhost:8443/<token> --api http://localhost:8081 \
+        --rates 50,100,200,400 --duration 10
+
+POSTs the synthetic updates (see `qg.bench.synthetic`) to the webhook at each of the given rates in turn
+and reports, per step, the achieved rate, the latency of the webhook itself and, if the bot talks to
+`qg.bench.fakeapi`, the share of the queries answered and the end-to-end latency of the answers.
+Throughput collapses where the answers stop keeping up with the offered rate.
+'''
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from dynaconf import settings
+
+from .replay import percentile
+from .synthetic import generate
+
+# the updates which get an answer through the Bot API, by the name of their id
+ANSWERED = {'inline_query': 'id', 'callback_query': 'id', 'pre_checkout_query': 'id'}
+
+
+def _post(url: str, update: dict) -> tuple[float, int]:
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode(), headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status = response.status
+    except OSError:
+        status = 0
+    return time.perf_counter() - start, status
+
+
+def _get(url: str):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def run_step(webhook: str, updates, rate: float, duration: float, concurrency: int):
+    '''Offer the updates at `rate` per second for `duration` seconds, returns [(update, sent_at, latency, status)]'''
+    results = []
+    lock = threading.Lock()
+
+    def send(update):
+        sent_at = time.time()
+        latency, status = _post(webhook, update)
+        with lock:
+            results.append((update, sent_at, latency, status))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for n in range(int(rate * duration)):
+            # open-loop: the schedule doesn't wait for the bot
+            if (delay := start + n / rate - time.perf_counter()) > 0:
+                time.sleep(delay)
+            pool.submit(send, next(updates))
+    return results
+
+
+def report_step(rate, results, duration, answers):
+    latencies = sorted(latency for _, _, latency, status in results if status == 200)
+    expected = {
+        str(update[kind][field]): sent_at
+        for update, sent_at, _, status in results if status == 200
+        for kind, field in ANSWERED.items() if kind in update
+    }
+    answer_latencies = sorted(answers[id] - sent_at for id, sent_at in expected.items() if id in answers)
+    return {
+        'offered_rate': rate,
+        'achieved_rate': len(results) / duration,
+        'errors': sum(1 for *_, status in results if status != 200),
+        'webhook_p50': percentile(latencies, 0.5),
+        'webhook_p99': percentile(latencies, 0.99),
+        'answered': f'{len(answer_latencies)}/{len(expected)}',
+        'answer_p50': percentile(answer_latencies, 0.5),
+        'answer_p99': percentile(answer_latencies, 0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m qg.bench.load', description='Load the webhook of a running bot.')
+    parser.add_argument('--webhook', required=True, help='URL of the webhook, i.e. http://host:<ws_port>/<token>')
+    parser.add_argument('--api', help='URL of the fake Bot API to collect the answers from')
+    parser.add_argument('--rates', default='50,100,200,400', help='updates per second at each step (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per step (default: %(default)s)')
+    parser.add_argument('--drain', type=float, default=5.0, help='seconds to wait for the answers after each step')
+    parser.add_argument('--concurrency', type=int, default=64, help='parallel connections (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=1000, help='number of synthetic users (default: %(default)s)')
+    parser.add_argument('--categories', help='comma-separated tags of the existing categories, from the settings otherwise')
+    args = parser.parse_args()
+
+    if args.categories:
+        categories = args.categories.split(',')
+    else:
+        categories = [category['tag'] for category in settings.DB.get('categories', [])] or ['bench']
+    # the ids differ between the runs, otherwise a bot with `dedupe` enabled would drop them
+    updates = generate(10 ** 9, categories, args.users, prefix=f'load-{int(time.time())}', first_id=time.time_ns() // 1000)
+
+    print(f'{"offered/s":>10} {"sent/s":>8} {"errors":>7} {"hook p50":>9} {"hook p99":>9} '
+          f'{"answered":>13} {"answer p50":>11} {"answer p99":>11}')
+    for rate in map(float, args.rates.split(',')):
+        results = run_step(args.webhook, updates, rate, args.duration, args.concurrency)
+        time.sleep(args.drain)
+        answers = _get(f'{args.api}/answers') if args.api else {}
+        step = report_step(rate, results, args.duration, answers)
+        print(f'{step["offered_rate"]:>10.0f} {step["achieved_rate"]:>8.1f} {step["errors"]:>7} '
+              f'{step["webhook_p50"] * 1000:>7.1f}ms {step["webhook_p99"] * 1000:>7.1f}ms {step["answered"]:>13} '
+              f'{step["answer_p50"] * 1000:>9.1f}ms {step["answer_p99"] * 1000:>9.1f}ms')
+
+    if args.api:
+        print(json.dumps(_get(f'{args.api}/stats'), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import time
+from collections import defaultdict
+from typing import Iterable
+
+from telegram import Update
+
+from qg.bot.instrumentation import instrument_handlers
+
+
+def percentile(values: list[float], q: float) -> float:
+    '''Nearest-rank percentile of the sorted `values`'''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+class Replay(object):
+    '''
+    Feeds the updates through the dispatcher of a `QGBot` one after another in the calling thread
+    and collects the timings of every handler.
+
+    The bot has to be created with no workers (`bot.workers` setting), so that the handlers are
+    run right in the dispatcher instead of being queued.
+    '''
+
+    def __init__(self, qgbot):
+        self.qgbot = qgbot
+        self.timings = defaultdict(list)
+        self.statements = defaultdict(int)
+        instrument_handlers(qgbot.dispatcher, self._observe, qgbot.db.query_stats)
+
+    def _observe(self, name, elapsed, statements):
+        self.timings[name].append(elapsed)
+        self.statements[name] += statements
+
+    def run(self, updates: Iterable[dict]) -> dict:
+        bot = self.qgbot.updater.bot
+        dispatcher = self.qgbot.dispatcher
+        query_stats = self.qgbot.db.query_stats
+
+        count = 0
+        statements = query_stats.statements
+        start = time.perf_counter()
+        for data in updates:
+            dispatcher.process_update(Update.de_json(data, bot))
+            count += 1
+        elapsed = time.perf_counter() - start
+
+        return {
+            'updates': count,
+            'seconds': elapsed,
+            'updates_per_second': count / elapsed if elapsed else 0.0,
+            # including the statements made in the background (e.g. by the message edits)
+            'statements_per_update': (query_stats.statements - statements) / count if count else 0.0,
+            'handlers': {
+                name: {
+                    'calls': len(timings),
+                    'p50': percentile(sorted_timings := sorted(timings), 0.5),
+                    'p95': percentile(sorted_timings, 0.95),
+                    'p99': percentile(sorted_timings, 0.99),
+                    'statements_per_call': self.statements[name] / len(timings)
+                }
+                for name, timings in sorted(self.timings.items())
+            }
+        }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f'{report["updates"]} updates in {report["seconds"]:.2f} s: '
+        f'{report["updates_per_second"]:.1f} updates/s, {report["statements_per_update"]:.2f} SQL statements/update',
+        '',
+        f'{"handler":<48} {"calls":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"SQL/call":>9}'
+    ]
+    for name, stats in report['handlers'].items():
+        lines.append(
+            f'{name:<48} {stats["calls"]:>7} {stats["p50"] * 1000:>8.2f} {stats["p95"] * 1000:>8.2f} '
+            f'{stats["p99"] * 1000:>8.2f} {stats["statements_per_call"]:>9.2f}'
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,54 @@
+import itertools
+import time
+
+from telegram import Bot
+
+BENCH_TOKEN = '123456:bench'
+
+
+def fake_result(method: str, data: dict, message_ids):
+    '''A plausible result of the Bot API `method` called with `data`'''
+    if method == 'getMe':
+        return {'id': 123456, 'is_bot': True, 'first_name': 'Quality Gate', 'username': 'qgbot'}
+    if method in ('sendMessage', 'sendInvoice', 'sendPhoto') or (
+            method == 'editMessageText' and 'inline_message_id' not in data):
+        return {
+            'message_id': next(message_ids),
+            'date': int(time.time()),
+            'chat': {'id': data.get('chat_id', 0), 'type': 'private'},
+            'text': data.get('text', '')
+        }
+    return True
+
+
+class StubRequest(object):
+    '''
+    Stands for `telegram.utils.request.Request` and answers every Bot API call locally
+    with a plausible result after the given `latency` (in seconds).
+    '''
+
+    con_pool_size = 64
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+
+    def post(self, url: str, data: dict = None, timeout: float = None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return fake_result(url.rsplit('/', 1)[-1], data or {}, self._message_ids)
+
+    def retrieve(self, url: str, timeout: float = None) -> bytes:
+        return b''
+
+    def download(self, url: str, filename: str, timeout: float = None):
+        pass
+
+    def stop(self):
+        pass
+
+
+def stub_bot(latency: float = 0.0) -> Bot:
+    return Bot(BENCH_TOKEN, request=StubRequest(latency))
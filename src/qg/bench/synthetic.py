@@ -0,0 +1,113 @@
+import random
+import time
+
+# relative frequencies of the kinds of updates, roughly as seen in production
+MIX = {
+    'inline_query': 30,
+    'chosen_inline_result': 5,
+    'vote': 55,
+    'stats': 5,
+    'donation': 5
+}
+
+STATS_CHOICES = ('Top Committers', 'Top Reviewers', 'Top Influencers')
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+
+def _message(message_id, user_id, text):
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return message
+
+
+def generate(count: int, categories: list[str], users: int = 1000, seed: int = 0, prefix: str = 'bench',
+             first_id: int = 1):
+    '''
+    Generate `count` updates (as dicts of the Bot API JSON) with the mix of `MIX`.
+
+    The votes go to the requests created earlier in the same stream, and a /stats command is followed
+    by a choice in the menu. The ids of the requests start with `prefix` and the ids of the updates
+    with `first_id`, so that several runs may share a database (a bot with `dedupe` enabled drops
+    the updates it has seen already). The pre-checkout queries refer to unknown invoices, as the invoice ids
+    are only known to the database.
+    '''
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX.items())
+    requests = []
+    update_id = first_id - 1
+    last_id = update_id + count
+
+    def next_id():
+        nonlocal update_id
+        update_id += 1
+        return update_id
+
+    while update_id < last_id:
+        user_id = rng.randint(1, users)
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'vote' and not requests:
+            kind = 'chosen_inline_result'
+
+        if kind == 'inline_query':
+            yield {
+                'update_id': next_id(),
+                'inline_query': {'id': str(update_id), 'from': _user(user_id), 'query': f'Proposal {update_id}', 'offset': ''}
+            }
+        elif kind == 'chosen_inline_result':
+            requests.append(request_id := f'{prefix}-{next_id()}')
+            yield {
+                'update_id': update_id,
+                'chosen_inline_result': {
+                    'result_id': rng.choice(categories),
+                    'from': _user(user_id),
+                    'query': f'Proposal {update_id}',
+                    'inline_message_id': request_id
+                }
+            }
+        elif kind == 'vote':
+            # the recent requests are the hottest ones
+            request_id = requests[-1 - min(int(rng.expovariate(0.2)), len(requests) - 1)]
+            yield {
+                'update_id': next_id(),
+                'callback_query': {
+                    'id': str(update_id),
+                    'from': _user(user_id),
+                    'chat_instance': request_id,
+                    'inline_message_id': request_id,
+                    'data': rng.choice(('up', 'down'))
+                }
+            }
+        elif kind == 'stats':
+            yield {'update_id': next_id(), 'message': _message(update_id, user_id, '/stats')}
+            yield {'update_id': next_id(), 'message': _message(update_id, user_id, rng.choice(STATS_CHOICES))}
+        elif kind == 'donation':
+            yield {
+                'update_id': next_id(),
+                'callback_query': {
+                    'id': str(update_id),
+                    'from': _user(user_id),
+                    'chat_instance': str(user_id),
+                    'message': _message(update_id, user_id, 'Choose the amount'),
+                    'data': f'stripe {rng.choice((1, 5, 10))}'
+                }
+            }
+            yield {
+                'update_id': next_id(),
+                'pre_checkout_query': {
+                    'id': str(update_id),
+                    'from': _user(user_id),
+                    'currency': 'EUR',
+                    'total_amount': 500,
+                    'invoice_payload': f'unknown-{update_id}'
+                }
+            }
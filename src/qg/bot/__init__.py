@@ -1 +1,2 @@
-from .bot import QGBot
+from .bot import QGBot, configure_logging
+from .cluster import Cluster
@@ -1,7 +1,8 @@
 from dynaconf import settings
 
-from .bot import QGBot
+from .bot import QGBot, configure_logging
 
 if __name__ == "__main__":
+	configure_logging()
 	bot = QGBot(settings.BOT.token)
 	bot.run(websocket=settings.BOT.ws_enabled)
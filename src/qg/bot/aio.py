@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from typing import Callable, Hashable, Optional
+
+from qg.logger import logger
+
+
+class EventLoopThread(object):
+    '''
+    An asyncio event loop running in a background thread.
+
+    The handlers submitted to it wait on the I/O without occupying a thread each, so thousands of
+    updates may be in flight at once. The coroutines with the same key are run one after another
+    in the order they were submitted, the same way as in `SerialExecutor`, and so is `wrap`.
+    '''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='event-loop', daemon=True)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._tails = {}
+        self._in_flight = 0
+        self.wrap = None
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, key: Optional[Hashable], coroutine_fn: Callable, *args, **kwargs):
+        with self._lock:
+            self._in_flight += 1
+            previous = self._tails.get(key) if key is not None else None
+            future = asyncio.run_coroutine_threadsafe(self._run_after(previous, coroutine_fn, *args, **kwargs), self.loop)
+            if key is not None:
+                self._tails[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    async def _run_after(self, previous, coroutine_fn, *args, **kwargs):
+        if previous is not None:
+            # the outcome of the previous task doesn't matter, only the order
+            await asyncio.wait([asyncio.wrap_future(previous)])
+        if self.wrap:
+            coroutine_fn = self.wrap(coroutine_fn)
+        try:
+            await coroutine_fn(*args, **kwargs)
+        except Exception:
+            logger.exception('Unhandled exception in the event loop')
+
+    def _done(self, key, future):
+        with self._lock:
+            self._in_flight -= 1
+            if key is not None and self._tails.get(key) is future:
+                del self._tails[key]
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    @property
+    def in_flight(self) -> int:
+        '''Number of coroutines which are submitted but not finished yet'''
+        return self._in_flight
+
+    def join(self):
+        '''Wait until all the submitted coroutines are finished'''
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight == 0)
+
+    def run(self, coroutine, timeout=None):
+        '''Run a coroutine on the loop and wait for its result'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -1,12 +1,12 @@
 import functools
-import itertools
+import json
 import re
-import sys
+import signal
+import threading
 from pathlib import Path
 
 from dynaconf import settings
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup,
-                      InlineQueryResultArticle, InputTextMessageContent,
                       LabeledPrice, ParseMode, Update)
 from telegram.error import Unauthorized
 from telegram.ext import (CallbackContext, CallbackQueryHandler,
@@ -16,28 +16,93 @@ from telegram.ext import (CallbackContext, CallbackQueryHandler,
 from telegram.utils.helpers import create_deep_linked_url
 
 from qg.db import DB
+from qg.db.aio import AsyncDB
+from qg.logger import configure as configure_logger
 from qg.logger import logger
 from qg.utils.helpers import escape_md, mention_md
 
-from .decorators import handler
+from .aio import EventLoopThread
+from .coalescer import EditCoalescer
+from .concurrency import SerialExecutor
+from .dedupe import UpdateDeduplicator
+from .decorators import by_chat, by_inline_message, handler, on_loop, serialized, skip_duplicates
+from .inbox import InboxDrainer, InboxWriter
+from .ingress import start_ingress
+from .inline import InlineResultTemplates
+from .instrumentation import (instrument_executor, instrument_handlers,
+                              instrument_loop, instrument_request)
+from .metrics import Metrics, MetricsServer
+from .outbox import Outbox, Priority
+from .render import VoteRenderer
 from .settings import SettingsMenu
 from .stats import StatisticsMenu
 
-logger.remove()
-logger.add(settings.LOGGER.filename, rotation='10 MB', compression='zip')
-logger.add(
-    sys.stderr,
-    level=settings.LOGGER.console_level,
-    colorize=True,
-    backtrace=True,
-    diagnose=True)
+
+def configure_logging(filename=None):
+    '''Set up the sinks of the logger from the settings, `filename` replaces the one of the settings'''
+    configure_logger(
+        filename=filename or settings.LOGGER.filename,
+        console_level=settings.LOGGER.console_level,
+        file_level=settings.LOGGER.file_level,
+        enqueue=settings.LOGGER.enqueue,
+        sampling=settings.LOGGER.get('sampling', {})
+    )
+
+
+def connect_db():
+    '''Connect to the database from the settings and bring its schema up to date'''
+    options = {
+        'echo': settings.DB.echo,
+        'known_users': settings.DB.known_users,
+        'admin_cache_ttl': settings.DB.admin_cache_ttl,
+        # the other processes may change the catalog, see `qg.bot.cluster`
+        'category_cache_ttl': settings.DB.category_cache_ttl if settings.BOT.processes > 1 else None,
+        'pool_size': settings.DB.pool.size,
+        'max_overflow': settings.DB.pool.max_overflow,
+        'pool_pre_ping': settings.DB.pool.pre_ping,
+        'pool_recycle': settings.DB.pool.recycle,
+        'statement_timeout': settings.DB.statement_timeout,
+        'slow_query_threshold': settings.DB.slow_query_threshold
+    }
+    if uri := settings.DB.get('FULL_URI', None):
+        db = DB(full_uri=uri, **options)
+    else:
+        db = DB(
+            user=settings.DB.user,
+            password=settings.DB.password,
+            db=settings.DB.name,
+            host=settings.DB.host,
+            port=settings.DB.port,
+            **options
+        )
+    db.create_all(settings.DB.admins, settings.DB.categories)
+    return db
 
 
 class QGBot(object):
-    def __init__(self, token=None):
+    def __init__(self, token=None, bot=None):
+        '''Either the `token` of the bot or a ready `telegram.Bot` (e.g. a stub for the benchmarks) is required'''
         self._initDB()
+        self.inline_results = InlineResultTemplates(self.db, self._inline_keyboard())
+
+        self.outbox = Outbox(
+            workers=settings.BOT.outbox.workers,
+            global_rate=settings.BOT.outbox.global_rate,
+            chat_rate=settings.BOT.outbox.chat_rate,
+            chat_burst=settings.BOT.outbox.chat_burst,
+            max_retries=settings.BOT.outbox.max_retries
+        )
 
-        self.updater = Updater(token, use_context=True)
+        if bot is not None:
+            self.updater = Updater(bot=bot, use_context=True)
+        else:
+            # the connection pool has to serve the dispatcher's threads (4 by default + 4 spare) and the outbox
+            self.updater = Updater(
+                token,
+                base_url=settings.BOT.api_url,
+                use_context=True,
+                request_kwargs={'con_pool_size': 8 + settings.BOT.outbox.workers}
+            )
         self.updater.bot.set_my_commands([
             ('/start', 'Show welcome information'),
             ('/help', 'Show the info on bot usage'),
@@ -48,10 +113,41 @@ class QGBot(object):
             ('/terms', 'Terms & Conditions')
         ])
         self.dispatcher = self.updater.dispatcher
+        # the handlers of the most frequent updates are run here, see `serialized`
+        self.workers = SerialExecutor(settings.BOT.workers)
+        self.vote_renderer = VoteRenderer(self.db, settings.BOT.render_cache)
+        self.vote_edits = EditCoalescer(
+            self.updater.job_queue, self.outbox, self.workers, settings.BOT.vote_edit_delay
+        )
+
+        # in the asyncio mode, the requests and the votes are handled on an event loop, see `on_loop`
+        if settings.BOT.asyncio:
+            self.loop = EventLoopThread()
+            self.adb = AsyncDB(
+                self.db,
+                pool_size=settings.DB.pool.size,
+                max_overflow=settings.DB.pool.max_overflow,
+                statement_timeout=settings.DB.statement_timeout
+            )
+        else:
+            self.loop = None
+            self.adb = None
 
         self._register_handlers()
+        self._initMetrics()
 
     def _register_handlers(self):
+        # the handlers which change the state claim their updates, see `_claim_id`
+        if settings.BOT.dedupe.enabled:
+            self.dedupe = UpdateDeduplicator(
+                self.db,
+                self.updater.job_queue,
+                ttl=settings.BOT.dedupe.ttl,
+                prune_interval=settings.BOT.dedupe.prune_interval
+            )
+        else:
+            self.dedupe = None
+
         # custom entry points (have to be registered before regular /start)
         invoice_filter = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}', re.I)
         self.dispatcher.add_handler(
@@ -64,6 +160,7 @@ class QGBot(object):
         # basic commands
         self.dispatcher.add_handler(CommandHandler('start', self.on_start))
         self.dispatcher.add_handler(CommandHandler('help', self.on_help))
+        self.dispatcher.add_handler(CommandHandler('recount', self.on_recount))
 
         # settings menu
         self.settings = SettingsMenu(self, self.dispatcher)
@@ -81,15 +178,28 @@ class QGBot(object):
 
         # inline mode
         self.dispatcher.add_handler(InlineQueryHandler(self.on_inline_query))
-        self.dispatcher.add_handler(ChosenInlineResultHandler(self.on_chosen_inline_query))
+        on_chosen_inline_query = self.on_chosen_inline_query_async if self.loop else self.on_chosen_inline_query
+        self.dispatcher.add_handler(ChosenInlineResultHandler(on_chosen_inline_query))
 
         # voting buttons
-        self.dispatcher.add_handler(CallbackQueryHandler(self.on_vote, pattern=r'^(up|down)$'))
+        on_vote = self.on_vote_async if self.loop else self.on_vote
+        self.dispatcher.add_handler(CallbackQueryHandler(on_vote, pattern=r'^(up|down)$'))
 
         # error handling
         self.dispatcher.add_error_handler(self.error)
 
     def run(self, websocket=True):
+        if settings.BOT.inbox.enabled:
+            # the updates are stored first and handled from the database, see `qg.bot.inbox`
+            writer = InboxWriter(self.db, settings.BOT.inbox.batch)
+            ingress = start_ingress(self.updater.bot, settings.BOT.token, websocket, writer.put)
+            try:
+                self.drain(0)
+            finally:
+                ingress.stop()
+                writer.stop()
+            return
+
         if websocket:
             logger.info('Opening a websocket…')
             self.updater.start_webhook(
@@ -103,39 +213,132 @@ class QGBot(object):
         else:
             logger.info('Starting polling…')
             self.updater.start_polling()
+        if self.metrics_server:
+            self.metrics_server.start()
         self.updater.idle()
+        self._shutdown()
+
+    def serve(self, updates):
+        '''
+        Handle the updates coming from the `updates` queue (as raw JSON) instead of the Bot API,
+        until None comes. That's how the worker processes of `qg.bot.cluster` are run.
+        '''
+        bot = self.updater.bot
+        self.updater.job_queue.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        while (data := updates.get()) is not None:
+            try:
+                update = Update.de_json(json.loads(data), bot)
+            except ValueError:
+                logger.exception('Failed to parse an update')
+                continue
+            self.dispatcher.process_update(update)
+        self.updater.job_queue.stop()
+        self._shutdown()
+
+    def drain(self, shard=0):
+        '''Handle the updates of the `shard` of the inbox until SIGINT or SIGTERM, see `qg.bot.inbox`'''
+        drainer = InboxDrainer(
+            self,
+            shard=shard,
+            batch=settings.BOT.inbox.batch,
+            lease=settings.BOT.inbox.lease,
+            poll_interval=settings.BOT.inbox.poll_interval,
+            max_attempts=settings.BOT.inbox.max_attempts
+        )
+        self.updater.job_queue.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        drainer.start()
+
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        stopped.wait()
+
+        logger.info('Finishing the current batch of updates…')
+        drainer.stop()
+        self.updater.job_queue.stop()
+        self._shutdown()
+
+    def _shutdown(self):
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self.workers.shutdown()
+        if self.loop:
+            self.loop.run(self.adb.dispose())
+            self.loop.stop()
+        self.outbox.stop()
+        logger.complete()
+
+    def _initMetrics(self):
+        if settings.BOT.get('metrics_port') is None:
+            self.metrics = None
+            self.metrics_server = None
+            return
+
+        self.metrics = Metrics()
+        self.metrics.query_stats = self.db.query_stats
+
+        # the handlers run on the workers are timed there, otherwise only their submission would be
+        instrument_handlers(self.dispatcher, self.metrics.observe_handler, self.db.query_stats, deferred=False)
+        instrument_executor(self.workers, self.metrics.observe_handler, self.db.query_stats)
+        if self.loop:
+            instrument_loop(self.loop, self.metrics.observe_handler)
+        instrument_request(self.updater.bot.request, self.metrics.observe_api_call)
+
+        pool = self.db.engine.pool
+        self.metrics.gauge('qgbot_dispatcher_queue_depth', 'Updates waiting for the dispatcher',
+            self.dispatcher.update_queue.qsize)
+        self.metrics.gauge('qgbot_workers', 'Tasks of the worker pool by state', lambda: {
+            (('state', 'pending'),): self.workers.pending,
+            (('state', 'busy'),): self.workers.busy
+        })
+        self.metrics.gauge('qgbot_workers_size', 'Threads in the worker pool', lambda: self.workers.workers)
+        self.metrics.gauge('qgbot_outbox_queue_depth', 'Bot API calls waiting in the outbox', lambda: self.outbox.pending)
+        if self.loop:
+            self.metrics.gauge('qgbot_event_loop_in_flight', 'Coroutines running on the event loop', lambda: self.loop.in_flight)
+        if hasattr(pool, 'checkedout'):
+            self.metrics.gauge('qgbot_db_pool_connections', 'Connections of the database pool by state', lambda: {
+                (('state', 'checked_out'),): pool.checkedout(),
+                (('state', 'idle'),): pool.checkedin()
+            })
+            self.metrics.gauge('qgbot_db_pool_size', 'Size of the database pool (without the overflow)', pool.size)
+
+        if self.dedupe:
+            self.metrics.gauge('qgbot_duplicate_updates', 'Redelivered updates dropped so far', lambda: self.dedupe.duplicates)
+        if settings.BOT.inbox.enabled:
+            self.metrics.gauge('qgbot_inbox_depth', 'Updates waiting in the inbox by shard', lambda: {
+                (('shard', shard),): count for shard, count in self.db.get_inbox_depth().items()
+            })
+
+        self.metrics_server = MetricsServer(self.metrics, settings.BOT.get('metrics_host', '127.0.0.1'), settings.BOT.metrics_port)
 
     def _initDB(self):
-        if uri := settings.DB.get('FULL_URI', None):
-            self.db = DB(full_uri=uri, echo=True)
-        else:
-            self.db = DB(
-                user=settings.DB.user,
-                password=settings.DB.password,
-                db=settings.DB.name,
-                host=settings.DB.host,
-                port=settings.DB.port,
-                echo=True
-            )
-        self.db.create_all(settings.DB.admins, settings.DB.categories)
+        self.db = connect_db()
 
     def error(self, update, context):
         '''Fallback handler to log the errors caused by Updates.'''
         logger.error(f'Update: "{update}" caused an error: "{context.error}"')
 
+    @serialized(by_chat)
     @logger.catch
     def on_start(self, update: Update, context: CallbackContext):
         '''
         /start command. Shows general information
         '''
-        update.message.reply_markdown_v2(
+        self.outbox.send(
+            update.message.reply_markdown_v2,
             escape_md(
                 'Welcome! I’m the “quality gate” bot for voting. '
                 'Think of me as a kind of @like, but with adjustable categories.\n\n'
                 'Check /help for more information.'
-            )
+            ),
+            rate_key=update.effective_chat.id
         )
 
+    @serialized(by_chat)
     @logger.catch
     @handler
     def on_help(self, update: Update, context: CallbackContext, is_admin):
@@ -152,15 +355,34 @@ class QGBot(object):
         )
         if is_admin:
             reply += '\n*Administration:*\n'
-            reply += '/settings — Various settings for admins'
+            reply += '/settings — Various settings for admins\n'
+            reply += '/recount — Recalculate the vote counters'
 
-        update.message.reply_markdown_v2(
+        self.outbox.send(
+            update.message.reply_markdown_v2,
             reply,
+            rate_key=update.effective_chat.id,
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton('Try me inline', switch_inline_query_current_chat='')]
             ])
         )
 
+    @serialized(by_chat)
+    @logger.catch
+    @handler(admin_only=True)
+    def on_recount(self, update: Update, context: CallbackContext):
+        '''
+        /recount command. Repairs the vote counters of all requests.
+        '''
+        with self.db.session():
+            updated = self.db.recount_votes()
+        self.vote_renderer.forget()
+        self.outbox.send(
+            update.message.reply_markdown_v2,
+            escape_md(f'Votes have been recounted on {updated} request{"s" if updated != 1 else ""}.'),
+            rate_key=update.effective_chat.id
+        )
+
     @functools.lru_cache
     def _inline_keyboard(self, up=0, down=0):
         '''
@@ -175,6 +397,7 @@ class QGBot(object):
         ]]
         return InlineKeyboardMarkup(keyboard)
 
+    @serialized(None)
     @logger.catch
     def on_inline_query(self, update: Update, context: CallbackContext):
         '''
@@ -185,99 +408,127 @@ class QGBot(object):
         if not query:
             return
 
-        with self.db.session():
-            results = [
-                InlineQueryResultArticle(
-                    id=tag,
-                    title=name,
-                    description=f'#{tag}_request',
-                    input_message_content=InputTextMessageContent(f'#{tag}_request {query}'),
-                    reply_markup=self._inline_keyboard()
-                )
-                for tag, (name, _) in self.db.get_categories().items()
-            ]
-        update.inline_query.answer(results, cache_time=0)
+        self.outbox.send(
+            update.inline_query.answer,
+            self.inline_results.results(query),
+            priority=Priority.URGENT,
+            cache_time=settings.BOT.inline_cache_time
+        )
 
+    @serialized(by_inline_message)
     @logger.catch
+    @skip_duplicates
     def on_chosen_inline_query(self, update: Update, context: CallbackContext):
         '''
         Store the vote request to the database.
         '''
         res = update.chosen_inline_result
-        logger.info(f'User {res.from_user} has submitted a new request with id "{res.inline_message_id}" '
-                    f'under "{res.result_id}" category. The message: {res.query}')
+        logger.info('User {} has submitted a new request with id "{}" under "{}" category.',
+                    res.from_user.id, res.inline_message_id, res.result_id)
+        logger.debug('The message of "{}": {}', res.inline_message_id, res.query)
         with self.db.session():
-            self.db.add_request(request_id=res.inline_message_id, user=res.from_user, category_tag=res.result_id, text=res.query)
+            self.db.add_request(
+                request_id=res.inline_message_id,
+                user=res.from_user,
+                category_tag=res.result_id,
+                text=res.query,
+                update_id=self._claim_id(update)
+            )
+
+    @on_loop(by_inline_message)
+    @logger.catch
+    @skip_duplicates
+    async def on_chosen_inline_query_async(self, update: Update, context: CallbackContext):
+        '''
+        Store the vote request to the database (the asyncio mode).
+        '''
+        res = update.chosen_inline_result
+        logger.info('User {} has submitted a new request with id "{}" under "{}" category.',
+                    res.from_user.id, res.inline_message_id, res.result_id)
+        logger.debug('The message of "{}": {}', res.inline_message_id, res.query)
+        await self.adb.add_request(
+            request_id=res.inline_message_id,
+            user=res.from_user,
+            category_tag=res.result_id,
+            text=res.query,
+            update_id=self._claim_id(update)
+        )
 
+    @serialized(by_inline_message)
     @logger.catch
+    @skip_duplicates
     def on_vote(self, update: Update, context: CallbackContext):
         '''
         Handle press on a vote button (inline message button).
         '''
+        query = update.callback_query
+        message_id = query.inline_message_id
+        user = query.from_user
+        is_upvote = query.data == 'up'
 
-        def group_votes(votes):
-            '''Partition all votes by the actual vote and collect the list of voters' usernames'''
-            all_votes = {}
-            for v, vs in itertools.groupby(votes, key=lambda v: v.upvote):
-                all_votes[v] = [v.user.mention_md() for v in vs]
-            logger.debug(f'all_votes: {all_votes}')
-
-            upvotes = all_votes.get(True, [])
-            downvotes = all_votes.get(False, [])
-
-            logger.info(f'{upvotes = }, {downvotes = }')
+        with self.db.session():
+            result = self.db.toggle_vote(message_id, user, is_upvote, self._claim_id(update))
+        self._after_vote(query, result)
 
-            return upvotes, downvotes
+    @on_loop(by_inline_message)
+    @logger.catch
+    @skip_duplicates
+    async def on_vote_async(self, update: Update, context: CallbackContext):
+        '''
+        Handle press on a vote button (the asyncio mode).
+        '''
+        query = update.callback_query
+        result = await self.adb.toggle_vote(
+            query.inline_message_id, query.from_user, query.data == 'up', self._claim_id(update)
+        )
+        self._after_vote(query, result)
 
-        def prepare_votes_string(upvotes: list[str], downvotes: list[str]) -> str:
-            '''Generate the string with the list of voters (to be appended to the message)'''
-            votes_string = ''
-            if upvotes:
-                votes_string += f'✅: {", ".join(upvotes)}\n'
-            if downvotes:
-                votes_string += f'❌: {", ".join(downvotes)}\n'
-            if votes_string:
-                votes_string = '\n\n*Votes:*\n' + votes_string
-            return votes_string
+    def _claim_id(self, update):
+        '''The update id to claim along with the handler's writes (see `qg.bot.dedupe`), if any'''
+        return self.dedupe.claim_id(update) if self.dedupe else None
 
-        query = update.callback_query
+    def _after_vote(self, query, result):
+        '''Answer the click and schedule the update of the voting message'''
         message_id = query.inline_message_id
-        user = query.from_user
-        is_upvote = query.data == 'up'
+        if result is None:
+            logger.error(f'A request with id "{message_id}" is not found although it should exist.')
+            return
 
-        logger.debug(f'Inline message id {message_id}')
+        if result.upvote is not None:
+            self.outbox.send(query.answer, 'Thanks for voting!', priority=Priority.URGENT)
+        else:
+            self.outbox.send(query.answer, 'You have taken you voice back.', priority=Priority.URGENT)
 
-        with self.db.session():
-            r = self.db.get_request(message_id)
-            if r is None:
-                logger.error(f'A request with id "{message_id}" is not found although it should exist.')
-                return
-
-            already_voted = self.db.has_voted(message_id, user, is_upvote)
-            if not already_voted:
-                self.db.add_vote(r.id, user, is_upvote)
-                query.answer('Thanks for voting!')
-            else:
-                self.db.revoke_vote(r.id, user)
-                query.answer('You have taken you voice back.')
+        self.vote_renderer.apply(message_id, query.from_user, result)
+        # clicks on the same message are merged into a single edit
+        self.vote_edits.edit(message_id, functools.partial(self._render_vote_message, message_id))
 
-            upvotes, downvotes = group_votes(self.db.get_votes(request_id=message_id))
-            votes_string = prepare_votes_string(upvotes, downvotes)
+    @logger.catch
+    def _render_vote_message(self, message_id):
+        '''
+        Render the current state of the voting message: the request, the lists of voters and the buttons.
+        '''
+        if (rendered := self.vote_renderer.render(message_id)) is None:
+            return None
 
-            query.edit_message_text(
-                escape_md(f'#{r.category_tag}_request {r.text}') + votes_string,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                reply_markup=self._inline_keyboard(up=len(upvotes), down=len(downvotes))
-            )
+        text, upvotes, downvotes = rendered
+        return {
+            'text': text,
+            'parse_mode': ParseMode.MARKDOWN_V2,
+            'reply_markup': self._inline_keyboard(up=upvotes, down=downvotes)
+        }
 
+    @serialized(by_chat)
     @logger.catch
     def on_terms(self, update: Update, context: CallbackContext):
         '''
         /terms command. Sends the Terms & Conditions.
         '''
         with open(Path('../img/marcus.png'), 'rb') as f:
-            update.message.reply_photo(f, caption='NO REFUNDS!')
+            photo = f.read()
+        self.outbox.send(update.message.reply_photo, photo, rate_key=update.effective_chat.id, caption='NO REFUNDS!')
 
+    @serialized(by_chat)
     @logger.catch
     def on_donate(self, update: Update, context: CallbackContext):
         '''
@@ -289,8 +540,10 @@ class QGBot(object):
         )
         response += '*Only today:* '
         response += escape_md('choose the ⭐️ option, get -10% discount and receive nothing in return!')
-        update.message.reply_markdown_v2(
+        self.outbox.send(
+            update.message.reply_markdown_v2,
             response,
+            rate_key=update.effective_chat.id,
             reply_markup=InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton('10€', callback_data='stripe 10'),
@@ -333,6 +586,7 @@ class QGBot(object):
             'start_parameter': f'donate-{price}'
         }, total
 
+    @serialized(by_chat)
     @logger.catch
     def on_invoice_request(self, update: Update, context: CallbackContext):
         '''
@@ -342,7 +596,7 @@ class QGBot(object):
         query = update.callback_query
 
         if (data := query.data) == 'cancel':
-            query.delete_message()
+            self.outbox.send(query.delete_message, rate_key=update.effective_chat.id)
             return
 
         provider, price = data.split(' ')
@@ -351,7 +605,7 @@ class QGBot(object):
         try:
             price = int(price)
         except ValueError:
-            query.delete_message()
+            self.outbox.send(query.delete_message, rate_key=update.effective_chat.id)
             return
 
         invoice_template, total = self.generate_invoice(price, currency)
@@ -367,23 +621,35 @@ class QGBot(object):
             )
 
         try:
-            user.send_invoice(
+            # the outcome defines the answer, so this is the only call which has to be waited for
+            self.outbox.call(
+                user.send_invoice,
+                rate_key=user.id,
+                priority=Priority.URGENT,
                 payload=invoice_id,
                 **invoice_template
             )
         except Unauthorized:  # User has never communicated to the bot directly
-            query.answer(
+            self.outbox.send(
+                query.answer,
                 'Check you private chat!',
+                priority=Priority.URGENT,
                 url=create_deep_linked_url(context.bot.get_me().username, invoice_id)
             )
         else:
             logger.debug(f'{chat.id = }')
             logger.debug(f'{user.id = }')
             if chat.id == user.id:
-                query.answer('The invoice is created!')
+                self.outbox.send(query.answer, 'The invoice is created!', priority=Priority.URGENT)
             else:
-                query.answer('I’ve dropped you an invoice into the private chat.', show_alert=True)
+                self.outbox.send(
+                    query.answer,
+                    'I’ve dropped you an invoice into the private chat.',
+                    priority=Priority.URGENT,
+                    show_alert=True
+                )
 
+    @serialized(by_chat)
     @logger.catch
     def on_start_with_invoice(self, update: Update, context: CallbackContext):
         '''
@@ -411,11 +677,15 @@ class QGBot(object):
             return
 
         invoice_template, total = self.generate_invoice(int(invoice.price), invoice.currency)
-        update.effective_user.send_invoice(
+        self.outbox.send(
+            update.effective_user.send_invoice,
+            rate_key=update.effective_user.id,
+            priority=Priority.URGENT,
             payload=invoice_id,
             **invoice_template
         )
 
+    @serialized(by_chat)
     @logger.catch
     def on_start_to_donate(self, update: Update, context: CallbackContext):
         '''
@@ -450,18 +720,24 @@ class QGBot(object):
                 currency=currency
             )
 
-        user.send_message(
+        # the same priority and chat keep these messages in order
+        self.outbox.send(
+            user.send_message,
             'Welcome! I’m the “quality gate” bot for voting. '
             'Think of me as a kind of @like, but with adjustable categories.\n\n'
             'It seems that someone has shown you a way to donate me. Although I appreciate it a lot, '
-            'I still recommend to try me out first. Check /help for more information.'
+            'I still recommend to try me out first. Check /help for more information.',
+            rate_key=user.id
         )
-        user.send_message('Here is your invoice if you change your mind:')
-        user.send_invoice(
+        self.outbox.send(user.send_message, 'Here is your invoice if you change your mind:', rate_key=user.id)
+        self.outbox.send(
+            user.send_invoice,
+            rate_key=user.id,
             payload=invoice_id,
             **invoice_template
         )
 
+    @serialized(by_chat)
     @logger.catch
     def on_pre_checkout(self, update: Update, context: CallbackContext):
         '''
@@ -472,12 +748,19 @@ class QGBot(object):
         with self.db.session():
             invoice = self.db.get_invoice(invoice_id)
         if invoice and not invoice.is_paid():
-            query.answer(ok=True)
+            self.outbox.send(query.answer, priority=Priority.URGENT, ok=True)
         else:
             logger.error(f'Got pre-checkout on non-existing invoice: {invoice_id}')
-            query.answer(ok=False, error_message='This invoice does not exist or was paid already')
+            self.outbox.send(
+                query.answer,
+                priority=Priority.URGENT,
+                ok=False,
+                error_message='This invoice does not exist or was paid already'
+            )
 
+    @serialized(by_chat)
     @logger.catch
+    @skip_duplicates
     def on_paid(self, update: Update, context: CallbackContext):
         '''
         The invoice is fulfilled. Need to store the data.
@@ -487,22 +770,29 @@ class QGBot(object):
             self.db.update_invoice(
                 invoice_id=payment.invoice_payload,
                 tg_charge_id=payment.telegram_payment_charge_id,
-                provider_charge_id=payment.provider_payment_charge_id
+                provider_charge_id=payment.provider_payment_charge_id,
+                update_id=self._claim_id(update)
             )
 
-        update.message.reply_markdown_v2(
+        self.outbox.send(
+            update.message.reply_markdown_v2,
             '*Thanks*\n' +
-            escape_md(f'You have successfully donated me {payment.total_amount / 100 :.2f}€')
+            escape_md(f'You have successfully donated me {payment.total_amount / 100 :.2f}€'),
+            rate_key=update.effective_chat.id,
+            priority=Priority.URGENT
         )
-        context.bot.send_message(
+        self.outbox.send(
+            context.bot.send_message,
             settings.BOT.owner,
             mention_md(
                 update.message.from_user.id,
                 update.message.from_user.name
             ) + escape_md(f' has just donated {payment.total_amount / 100 :.2f}€'),
+            rate_key=settings.BOT.owner,
             parse_mode=ParseMode.MARKDOWN_V2,
         )
 
+    @serialized(by_chat)
     @logger.catch
     def on_donate_stats(self, update: Update, context: CallbackContext):
         '''
@@ -515,4 +805,4 @@ class QGBot(object):
                 for user, total in self.db.get_donators()
             ])
         logger.info(f'{donators = }')
-        update.message.reply_markdown_v2(response)
+        self.outbox.send(update.message.reply_markdown_v2, response, rate_key=update.effective_chat.id)
@@ -0,0 +1,139 @@
+'''
+The multi-process mode: a front process receives the updates (by a webhook or polling) and routes
+them to the worker processes, each of which runs a `QGBot` of its own. The workers share nothing
+but the database.
+
+An update is routed by the hash of its inline message (the chosen inline results and the votes),
+otherwise of its chat or user, the same keys as the ones of `serialized`. So the updates on the same
+message or in the same conversation are always handled by the same worker in the order of arrival.
+'''
+import json
+import multiprocessing
+import signal
+import threading
+import zlib
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Optional
+
+from dynaconf import settings
+from telegram import Bot
+
+from qg.logger import logger
+
+from .bot import QGBot, configure_logging, connect_db
+from .inbox import InboxWriter
+from .ingress import start_ingress
+
+
+def shard_key(update: dict):
+    '''The routing key of a raw update: the same as `by_inline_message` of the decoded one'''
+    payload = next((value for name, value in update.items() if name != 'update_id' and isinstance(value, dict)), {})
+    if inline_message_id := payload.get('inline_message_id'):
+        return ('inline_message', inline_message_id)
+    if chat := payload.get('chat') or payload.get('message', {}).get('chat'):
+        return ('chat', chat['id'])
+    if user := payload.get('from'):
+        return ('user', user['id'])
+    return None
+
+
+def shard_of(update: dict, shards: int) -> int:
+    if (key := shard_key(update)) is None:
+        return update.get('update_id', 0) % shards
+    # not the built-in `hash`, which differs between runs
+    return zlib.crc32(repr(key).encode('utf-8')) % shards
+
+
+class Cluster(object):
+    '''
+    The front process, see the module's docstring. The updates are passed to the workers through
+    the queues of `multiprocessing`, or through the shards of the inbox if it's enabled (`qg.bot.inbox`).
+    '''
+
+    def __init__(self, token: str, processes: int):
+        self.token = token
+        self.processes = processes
+        self.bot = Bot(token, base_url=settings.BOT.api_url)
+        # the schema is brought up to date once, before the workers start
+        self.db = connect_db()
+        self.inbox = InboxWriter(self.db, settings.BOT.inbox.batch) if settings.BOT.inbox.enabled else None
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._workers = []
+        self._stopped = threading.Event()
+
+    def run(self, websocket=True):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: self._stopped.set())
+
+        for index in range(1, self.processes + 1):
+            queue = self._context.Queue() if self.inbox is None else None
+            worker = self._context.Process(
+                target=_work, args=(index, self.processes, self.token, queue), name=f'qgbot-worker-{index}'
+            )
+            worker.start()
+            self._queues.append(queue)
+            self._workers.append(worker)
+
+        logger.info(f'Routing the updates to {self.processes} workers…')
+        ingress = start_ingress(self.bot, self.token, websocket, self.route)
+        try:
+            sentinels = [worker.sentinel for worker in self._workers]
+            while not self._stopped.is_set():
+                if wait(sentinels, timeout=1.0):
+                    # the rest of the workers can't take over its updates without breaking the order
+                    logger.error('A worker process has exited unexpectedly, stopping the cluster.')
+                    break
+        finally:
+            ingress.stop()
+            self._stop()
+
+    def route(self, data: bytes):
+        '''Pass a raw update to its worker'''
+        try:
+            update = json.loads(data)
+        except ValueError:
+            logger.error('Received a malformed update')
+            return
+        shard = shard_of(update, self.processes)
+        if self.inbox is not None:
+            self.inbox.put(data, shard)
+        else:
+            self._queues[shard].put(data)
+
+    def _stop(self):
+        logger.info('Stopping the workers…')
+        if self.inbox is not None:
+            self.inbox.stop()
+            # the workers finish their current batches, the rest stays in the inbox
+            for worker in self._workers:
+                worker.terminate()
+        else:
+            for queue in self._queues:
+                queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        logger.complete()
+
+
+def _work(index: int, processes: int, token: str, updates: Optional[multiprocessing.Queue]):
+    if updates is not None:
+        # Ctrl+C reaches the whole process group, the workers are stopped by the front instead
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # the files can't be rotated by several processes at once
+    path = Path(settings.LOGGER.filename)
+    configure_logging(filename=str(path.with_name(f'{path.stem}.{index}{path.suffix}')))
+
+    # the limit of the Bot API is for the bot as a whole
+    settings.set('BOT.processes', processes)
+    settings.set('BOT.outbox.global_rate', settings.BOT.outbox.global_rate / processes)
+    if (port := settings.BOT.get('metrics_port')) is not None:
+        settings.set('BOT.metrics_port', port + index)
+
+    logger.info(f'Worker {index} of {processes} is starting…')
+    if updates is not None:
+        QGBot(token).serve(updates)
+    else:
+        QGBot(token).drain(shard=index - 1)
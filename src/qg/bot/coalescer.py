@@ -0,0 +1,107 @@
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext, JobQueue
+
+from qg.logger import logger
+
+from .concurrency import SerialExecutor
+from .decorators import inline_message_key
+from .outbox import Outbox, Priority
+
+
+class EditCoalescer(object):
+    '''
+    Merges the edits of the same inline message which happen within a short window.
+
+    Instead of editing the message on every vote, the message is rendered once at the end
+    of the window, so that only the latest state is sent. Also, the edit is skipped completely
+    if the rendered text and keyboard are the same as the ones sent last time.
+
+    The job queue only hands the edit over to `executor`: rendering may load the message from the database,
+    which mustn't hold up the other jobs. The edits are submitted with the same key as the votes on the message
+    (see `by_inline_message`), so a message is rendered one vote at a time.
+    '''
+
+    def __init__(self, job_queue: JobQueue, outbox: Outbox, executor: SerialExecutor, delay: float,
+                 max_messages: int = 1024):
+        self.job_queue = job_queue
+        self.outbox = outbox
+        self.executor = executor
+        self.delay = delay
+        self.max_messages = max_messages
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = set()
+        self._sent = OrderedDict()
+
+    def edit(self, inline_message_id: str, render: Callable[[], Optional[dict]]):
+        '''
+        Schedule an edit of the inline message.
+
+        `render` is called at the end of the window and has to return the keyword arguments
+        for `Bot.edit_message_text` (at least `text` and `reply_markup`) or None to skip the edit.
+        '''
+        with self._lock:
+            scheduled = inline_message_id in self._pending
+            self._pending[inline_message_id] = render
+        if not scheduled:
+            self.job_queue.run_once(self._flush, self.delay, context=inline_message_id)
+
+    def _flush(self, context: CallbackContext):
+        inline_message_id = context.job.context
+        self.executor.submit(inline_message_key(inline_message_id), self._send, context.bot, inline_message_id)
+
+    def _send(self, bot: Bot, inline_message_id: str):
+        with self._lock:
+            if inline_message_id in self._in_flight:
+                # the previous state is still being sent, so wait for it not to overwrite the newer one
+                self.job_queue.run_once(self._flush, self.delay, context=inline_message_id)
+                return
+            render = self._pending.pop(inline_message_id)
+            self._in_flight.add(inline_message_id)
+
+        future = None
+        try:
+            kwargs = render()
+            if kwargs is None:
+                return
+
+            state = (kwargs['text'], kwargs['reply_markup'].to_dict())
+            with self._lock:
+                if self._sent.get(inline_message_id) == state:
+                    logger.debug('Message "{}" is up to date, skipping the edit.', inline_message_id)
+                    return
+
+            future = self.outbox.submit(
+                bot.edit_message_text,
+                rate_key=inline_message_id,
+                priority=Priority.LOW,
+                inline_message_id=inline_message_id,
+                **kwargs
+            )
+            future.add_done_callback(functools.partial(self._on_sent, inline_message_id, state))
+        finally:
+            if future is None:
+                with self._lock:
+                    self._in_flight.discard(inline_message_id)
+
+    def _on_sent(self, inline_message_id: str, state, future: Future):
+        with self._lock:
+            self._in_flight.discard(inline_message_id)
+
+            if (e := future.exception()) is not None:
+                if not (isinstance(e, BadRequest) and 'not modified' in e.message):
+                    logger.error(f'Failed to edit the message "{inline_message_id}": {e!r}')
+                    return
+
+            self._sent[inline_message_id] = state
+            self._sent.move_to_end(inline_message_id)
+            while len(self._sent) > self.max_messages:
+                self._sent.popitem(last=False)
@@ -0,0 +1,96 @@
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Optional
+
+from qg.logger import logger
+
+
+class SerialExecutor(object):
+    '''
+    Runs the tasks on a pool of threads in parallel, except the tasks with the same key,
+    which are run one after another in the order they were submitted.
+
+    With no workers at all, the tasks are run right away in the calling thread.
+
+    If `wrap` is set, every submitted callable is replaced with `wrap(fn)` (e.g. to time the tasks).
+    '''
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker') if workers > 0 else None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queues = {}
+        self._pending = 0
+        self._busy = 0
+        self.wrap = None
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args, **kwargs):
+        task = functools.partial(self.wrap(fn) if self.wrap else fn, *args, **kwargs)
+
+        if self._pool is None:
+            self._run(task)
+            return
+
+        with self._lock:
+            self._pending += 1
+            if key is not None:
+                if (queue := self._queues.get(key)) is not None:
+                    # the key is being processed already, the task is going to be picked up after the others
+                    queue.append(task)
+                    return
+                self._queues[key] = deque([task])
+
+        if key is None:
+            self._pool.submit(self._run_pending, task)
+        else:
+            self._pool.submit(self._drain, key)
+
+    @property
+    def pending(self) -> int:
+        '''Number of tasks which are submitted but not started yet'''
+        return self._pending
+
+    @property
+    def busy(self) -> int:
+        '''Number of workers running a task right now'''
+        return self._busy
+
+    def join(self):
+        '''Wait until all the submitted tasks are finished'''
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0 and self._busy == 0)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                task = queue.popleft()
+            self._run_pending(task)
+
+    def _run_pending(self, task):
+        with self._lock:
+            self._pending -= 1
+            self._busy += 1
+        try:
+            self._run(task)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                if self._pending == 0 and self._busy == 0:
+                    self._idle.notify_all()
+
+    def _run(self, task):
+        try:
+            task()
+        except Exception:
+            logger.exception('Unhandled exception in the worker')
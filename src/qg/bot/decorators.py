@@ -1,7 +1,9 @@
 import functools
+import inspect
 
 from telegram.replykeyboardremove import ReplyKeyboardRemove
 
+from qg.db import DuplicateUpdate
 from qg.logger import logger
 from qg.utils.helpers import escape_md
 
@@ -16,13 +18,8 @@ def handler(*args, admin_only=False):
             with bot.db.session():
                 if update.effective_user:
                     user_id = update.effective_user.id
-                    user = bot.db.find_user(user_id)
-                    if user is None:
-                        logger.debug(f'Unknown user with id "{user_id}" has invoked the command.')
-                        is_admin = False
-                    else:
-                        logger.debug(f'User "{user}" has invoked the command.')
-                        is_admin = user.is_admin
+                    logger.debug('User "{}" has invoked the command.', user_id)
+                    is_admin = bot.db.is_admin(user_id)
 
                     logger.info('User is admin.' if is_admin else 'User is not admin.')
 
@@ -39,22 +36,19 @@ def handler(*args, admin_only=False):
             handler_result = cSTOPPING
             if update.effective_user:
                 user_id = update.effective_user.id
+                logger.debug('User "{}" has invoked the command.', user_id)
                 with bot.db.session():
-                    user = bot.db.find_user(user_id)
-                    if user is None:
-                        logger.debug(f'Unknown user with id "{user_id}" has invoked the command.')
-                        is_admin = False
-                    else:
-                        logger.debug(f'User "{user}" has invoked the command.')
-                        is_admin = user.is_admin
+                    is_admin = bot.db.is_admin(user_id)
 
                 logger.info('User is admin.' if is_admin else 'User is not admin.')
 
                 if is_admin:
                     handler_result = func(bot, update, *args, **kwargs)
                 else:
-                    update.message.reply_markdown_v2(
+                    bot.outbox.send(
+                        update.message.reply_markdown_v2,
                         escape_md('Sorry, this function is available for admins only. Aborting.'),
+                        rate_key=update.effective_chat.id,
                         reply_markup=ReplyKeyboardRemove()
                     )
 
@@ -68,3 +62,78 @@ def handler(*args, admin_only=False):
             return restricted(args[0])
         else:
             return restricted
+
+
+def serialized(key):
+    '''
+    Runs the decorated handler on the bot's worker pool instead of the dispatcher thread.
+    The updates with the same `key(update)` (e.g. `by_inline_message` or `by_chat`) are handled
+    one at a time in the order of arrival, the ones with None as a key are not ordered at all.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(bot, update, *args, **kwargs):
+            bot.workers.submit(key(update) if key else None, func, bot, update, *args, **kwargs)
+        wrapped.__deferred__ = True
+        return wrapped
+    return decorator
+
+
+def on_loop(key):
+    '''
+    Runs the decorated coroutine handler on the bot's event loop (the asyncio mode).
+    The ordering by `key(update)` is the same as with `serialized`.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(bot, update, *args, **kwargs):
+            bot.loop.submit(key(update) if key else None, func, bot, update, *args, **kwargs)
+        wrapped.__deferred__ = True
+        return wrapped
+    return decorator
+
+
+def skip_duplicates(func):
+    '''
+    Drops the update quietly if the decorated handler raises `DuplicateUpdate` (see `qg.bot.dedupe`).
+    Works with the coroutine handlers as well.
+    '''
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapped_async(bot, update, *args, **kwargs):
+            try:
+                return await func(bot, update, *args, **kwargs)
+            except DuplicateUpdate:
+                bot.dedupe.skip(update)
+        return wrapped_async
+
+    @functools.wraps(func)
+    def wrapped(bot, update, *args, **kwargs):
+        try:
+            return func(bot, update, *args, **kwargs)
+        except DuplicateUpdate:
+            bot.dedupe.skip(update)
+    return wrapped
+
+
+def by_inline_message(update):
+    '''Updates on the same inline message: the chosen inline result and the votes'''
+    if update.callback_query and update.callback_query.inline_message_id:
+        return inline_message_key(update.callback_query.inline_message_id)
+    if update.chosen_inline_result and update.chosen_inline_result.inline_message_id:
+        return inline_message_key(update.chosen_inline_result.inline_message_id)
+    return by_chat(update)
+
+
+def inline_message_key(inline_message_id):
+    '''The key of `by_inline_message` for the other work on the message (e.g. its edits)'''
+    return ('inline_message', inline_message_id)
+
+
+def by_chat(update):
+    '''Updates in the same chat, or from the same user if there is no chat'''
+    if update.effective_chat:
+        return ('chat', update.effective_chat.id)
+    if update.effective_user:
+        return ('user', update.effective_user.id)
+    return None
@@ -0,0 +1,46 @@
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, JobQueue
+
+from qg.logger import logger
+
+
+class UpdateDeduplicator(object):
+    '''
+    Keeps the updates which change the state from being handled twice: Telegram redelivers an update when
+    the webhook doesn't answer in time, and a vote handled twice would be taken back.
+
+    Only the callback queries (the votes), the chosen inline results and the successful payments are tracked
+    (see `claim_id`), the rest (e.g. every keystroke of an inline query) is safe to handle again and costs
+    nothing. A handler passes the id to the `DB` method which makes its writes, and the id is recorded in
+    the `ProcessedUpdates` table in the same transaction. If it's recorded already, `DuplicateUpdate` is raised
+    before anything is written (see `skip_duplicates`). So an update is recorded only if its handler has
+    succeeded, and the one being handled when the process died is handled again after a restart.
+
+    The records older than `ttl` seconds are pruned every `prune_interval` seconds,
+    Telegram doesn't keep the updates for longer than 24 hours anyway.
+    '''
+
+    def __init__(self, db, job_queue: JobQueue, ttl: float, prune_interval: float):
+        self.db = db
+        self.ttl = ttl
+        self.duplicates = 0
+        job_queue.run_repeating(self._prune_job, interval=prune_interval, first=prune_interval)
+
+    def claim_id(self, update: Update) -> Optional[int]:
+        '''The id to claim along with the writes of the update's handler, or None if it's not tracked'''
+        if update.callback_query or update.chosen_inline_result:
+            return update.update_id
+        if update.message and update.message.successful_payment:
+            return update.update_id
+        return None
+
+    def skip(self, update: Update):
+        self.duplicates += 1
+        logger.debug('Update {} has been handled already, skipping it.', update.update_id)
+
+    @logger.catch
+    def _prune_job(self, context: CallbackContext):
+        if pruned := self.db.prune_processed_updates(self.ttl):
+            logger.debug('Forgot {} processed updates.', pruned)
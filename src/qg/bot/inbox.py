@@ -0,0 +1,132 @@
+'''
+The durable queue of the received updates (the `Inbox` table).
+
+The webhook (or polling) only appends an update to the inbox and acknowledges it to Telegram right
+after the commit, however far behind the handlers are. The updates are handed to the dispatcher from
+there in batches, and a batch is removed only after all its handlers have finished. So an update is
+handled at least once: the batch a process was in the middle of when it died is handled again.
+'''
+import json
+import queue
+import threading
+from concurrent.futures import Future
+
+from telegram import Update
+
+from qg.logger import logger
+
+
+class InboxWriter(object):
+    '''
+    Appends the updates to the inbox. The updates arriving at the same time are written with a single
+    statement (a group commit), and `put` returns once its update is committed.
+    '''
+
+    def __init__(self, db, batch=100):
+        self.db = db
+        self.batch = batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='inbox-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, data: bytes, shard=0, timeout=None):
+        '''Raises if the update couldn't be written'''
+        future = Future()
+        self._queue.put((shard, data.decode('utf-8'), future))
+        future.result(timeout)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            if (item := self._queue.get()) is None:
+                return
+            items = [item]
+            while len(items) < self.batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                items.append(item)
+
+            try:
+                self.db.enqueue_updates([(shard, payload) for shard, payload, _ in items])
+            except Exception as e:
+                logger.exception(f'Failed to write {len(items)} updates to the inbox')
+                for _, _, future in items:
+                    future.set_exception(e)
+            else:
+                for _, _, future in items:
+                    future.set_result(None)
+
+
+class InboxDrainer(object):
+    '''
+    Hands the updates of a shard of the inbox to the dispatcher of a `QGBot` in batches and removes
+    a batch once the handlers are done with it. `lease` (in seconds) has to be longer than a batch
+    takes to handle, otherwise the batch is handed out again meanwhile.
+
+    An update leased more than `max_attempts` times (i.e. the process keeps dying on it) is dropped.
+    '''
+
+    def __init__(self, qgbot, shard=0, batch=100, lease=30.0, poll_interval=0.2, max_attempts=5):
+        self.qgbot = qgbot
+        self.shard = shard
+        self.batch = batch
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'inbox-{shard}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        '''Finish the current batch and stop'''
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                drained = self._drain()
+            except Exception:
+                logger.exception(f'Failed to drain the shard {self.shard} of the inbox')
+                drained = 0
+            if not drained:
+                self._stopped.wait(self.poll_interval)
+
+    def _drain(self) -> int:
+        db = self.qgbot.db
+        bot = self.qgbot.updater.bot
+        dispatcher = self.qgbot.dispatcher
+
+        rows = db.lease_updates(self.shard, self.batch, self.lease)
+        if not rows:
+            return 0
+
+        for row in rows:
+            if row.attempts > self.max_attempts:
+                logger.error(f'The update {row.id} has been handed out {row.attempts} times, dropping it: {row.payload}')
+                continue
+            try:
+                update = Update.de_json(json.loads(row.payload), bot)
+            except ValueError:
+                logger.exception(f'Failed to parse the update {row.id}')
+                continue
+            dispatcher.process_update(update)
+
+        # the handlers may be still running on the workers
+        self.qgbot.workers.join()
+        if self.qgbot.loop:
+            self.qgbot.loop.join()
+
+        db.ack_updates([row.id for row in rows])
+        return len(rows)
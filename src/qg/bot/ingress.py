@@ -0,0 +1,111 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from dynaconf import settings
+from telegram import Bot
+from telegram.error import TelegramError
+
+from qg.logger import logger
+
+
+def start_ingress(bot: Bot, token: str, websocket: bool, route: Callable[[bytes], None]):
+    '''
+    Start receiving the updates by the webhook on `ws_port` (and register it) or by polling.
+    Returns the `WebhookServer` or the `Poller` to stop afterwards.
+    '''
+    if websocket:
+        logger.info('Opening a websocket…')
+        server = WebhookServer(token, ('0.0.0.0', settings.BOT.ws_port), route)
+        server.start()
+        bot.set_webhook(f'{settings.BOT.base_url}/{token}')
+        return server
+
+    logger.info('Starting polling…')
+    poller = Poller(bot, route)
+    poller.start()
+    return poller
+
+
+class WebhookServer(ThreadingHTTPServer):
+    '''
+    Receives the updates POSTed by Telegram to `/<token>` and passes the raw JSON of each one to `route`.
+    Telegram gets the response only after `route` returns; if it raises, the update is delivered again later.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, token: str, address, route: Callable[[bytes], None]):
+        self.token = token
+        self.route = route
+        super().__init__(address, _WebhookHandler)
+        self._thread = threading.Thread(target=self.serve_forever, name='webhook', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.strip('/') != self.server.token:
+            self.send_error(403)
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            self.server.route(data)
+        except Exception:
+            logger.exception('Failed to accept an update')
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Poller(object):
+    '''
+    Long polling of the updates, the raw JSON of each one is passed to `route`.
+    An update is confirmed to Telegram (by the offset of the next request) only after `route` returns.
+    '''
+
+    def __init__(self, bot: Bot, route: Callable[[bytes], None], timeout=10):
+        self.bot = bot
+        self.route = route
+        self.timeout = timeout
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='polling', daemon=True)
+
+    def start(self):
+        self.bot.delete_webhook()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        offset = None
+        while not self._stopped.is_set():
+            try:
+                updates = self.bot.get_updates(offset=offset, timeout=self.timeout)
+            except TelegramError as e:
+                logger.warning(f'Failed to get the updates: {e!r}')
+                self._stopped.wait(1.0)
+                continue
+            for update in updates:
+                try:
+                    self.route(json.dumps(update.to_dict()).encode('utf-8'))
+                except Exception:
+                    # the rest is going to be received again
+                    logger.exception('Failed to accept an update')
+                    self._stopped.wait(1.0)
+                    break
+                offset = update.update_id + 1
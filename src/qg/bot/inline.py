@@ -0,0 +1,57 @@
+from telegram import (InlineKeyboardMarkup, InlineQueryResult,
+                      InlineQueryResultArticle)
+
+
+class PrerenderedResult(InlineQueryResult):
+    '''
+    An inline query result made of an already serialized template.
+
+    Only the message text is spliced in when the result is sent, everything else
+    is shared between all the queries.
+    '''
+
+    def __init__(self, template: dict, text: str):
+        super().__init__(template['type'], template['id'])
+        self._template = template
+        self._text = text
+
+    def to_dict(self):
+        data = dict(self._template)
+        data['input_message_content'] = {'message_text': self._text}
+        return data
+
+
+class InlineResultTemplates(object):
+    '''
+    Inline query results for every category, pre-rendered once per category catalog.
+
+    The templates are rebuilt only when `DB.get_categories` returns a different catalog,
+    i.e. after a category has been added or removed.
+    '''
+
+    def __init__(self, db, reply_markup: InlineKeyboardMarkup):
+        self.db = db
+        self.reply_markup = reply_markup
+        self._cache = (None, [])
+
+    def _build(self, catalog):
+        templates = []
+        for tag, (name, _) in catalog.items():
+            template = InlineQueryResultArticle(
+                id=tag,
+                title=name,
+                description=f'#{tag}_request',
+                input_message_content=None,
+                reply_markup=self.reply_markup
+            ).to_dict()
+            templates.append((template, f'#{tag}_request '))
+        return templates
+
+    def results(self, query: str) -> list[PrerenderedResult]:
+        '''Make the list of results for the `query` text'''
+        catalog = self.db.get_categories()
+        cached_catalog, templates = self._cache
+        if catalog is not cached_catalog:
+            templates = self._build(catalog)
+            self._cache = (catalog, templates)
+        return [PrerenderedResult(template, prefix + query) for template, prefix in templates]
@@ -0,0 +1,103 @@
+import functools
+import time
+from typing import Callable
+
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler, Dispatcher
+from telegram.utils.request import Request
+
+from qg.db.instrumentation import QueryStats
+
+from .aio import EventLoopThread
+from .concurrency import SerialExecutor
+
+
+def instrument_handlers(dispatcher: Dispatcher, observe: Callable[[str, float, int], None], query_stats: QueryStats = None,
+                        deferred: bool = True):
+    '''
+    Wrap the callbacks of all the handlers registered in the dispatcher (including the ones
+    in the conversations) so that every call reports `observe(name, seconds, statements)`,
+    where `statements` is the number of SQL statements made by the call in its thread.
+
+    Note that the handlers which are run on the worker pool are measured only up to their submission,
+    unless there are no workers. With `deferred=False` such handlers are skipped here, so that they
+    can be measured by `instrument_executor` and `instrument_loop` instead.
+    '''
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            _instrument(handler, observe, query_stats, deferred)
+
+
+def instrument_executor(executor: SerialExecutor, observe: Callable[[str, float, int], None], query_stats: QueryStats = None):
+    '''Report every task run by the worker pool the same way as `instrument_handlers` does'''
+    executor.wrap = lambda fn: _timed(_name(fn), fn, observe, query_stats)
+
+
+def instrument_loop(loop: EventLoopThread, observe: Callable[[str, float, int], None]):
+    '''Report every coroutine run on the event loop, the statements are not counted there'''
+    def wrap(coroutine_fn):
+        name = _name(coroutine_fn)
+
+        @functools.wraps(coroutine_fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await coroutine_fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, 0)
+        return timed
+    loop.wrap = wrap
+
+
+def instrument_request(request: Request, observe: Callable[[str, float, str], None]):
+    '''
+    Report every Bot API call made through the `request` as `observe(method, seconds, error)`,
+    where `error` is the name of the exception class or None.
+    '''
+    post = request.post
+
+    @functools.wraps(post)
+    def timed(url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        error = None
+        try:
+            return post(url, *args, **kwargs)
+        except (TelegramError, OSError) as e:
+            error = type(e).__name__
+            raise
+        finally:
+            observe(method, time.perf_counter() - start, error)
+    request.post = timed
+
+
+def _name(fn) -> str:
+    return getattr(fn, '__qualname__', None) or getattr(fn, '__name__', repr(fn))
+
+
+def _timed(name, fn, observe, query_stats):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        statements = query_stats.thread_statements if query_stats else 0
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe(name, elapsed, (query_stats.thread_statements - statements) if query_stats else 0)
+    timed.__instrumented__ = True
+    return timed
+
+
+def _instrument(handler, observe, query_stats, deferred):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+            _instrument(nested, observe, query_stats, deferred)
+        return
+
+    callback = handler.callback
+    if getattr(callback, '__instrumented__', False):
+        return
+    if not deferred and getattr(callback, '__deferred__', False):
+        return
+    handler.callback = _timed(_name(callback), callback, observe, query_stats)
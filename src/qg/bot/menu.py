@@ -169,7 +169,7 @@ class MenuItem(BaseMenu):
         self.accept_all = accept_all
 
     def _build_entry_points(self):
-        logger.debug(f'MenuItem: {self.name}')
+        logger.debug('MenuItem: {}', self.name)
         if self.accept_all:
             filters = (Filters.text
                        & ~Filters.text(BACK_BUTTON_TEXT)
@@ -0,0 +1,142 @@
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Union
+
+from qg.logger import logger
+from qg.utils.histogram import Histogram
+
+# number of SQL statements per handler call
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    '''
+    Metrics of the bot in the Prometheus text format.
+
+    The latencies are kept in the histograms of `qg.utils.histogram`. The gauges (queue depths, pool
+    utilization, etc.) are the callables which are read at the moment of scraping, so that nothing
+    has to be updated on the hot path. A gauge returns either a number or a dict of
+    `{labels: number}`, where `labels` is a tuple of (name, value) pairs.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._handler_statements = {}
+        self._api = {}
+        self._api_errors = defaultdict(int)
+        self._gauges = []
+        self.query_stats = None
+
+    def _histogram(self, histograms: dict, key, buckets=None) -> Histogram:
+        if (histogram := histograms.get(key)) is None:
+            with self._lock:
+                histogram = histograms.setdefault(key, Histogram(buckets) if buckets else Histogram())
+        return histogram
+
+    def observe_handler(self, name: str, elapsed: float, statements: int):
+        self._histogram(self._handlers, name).observe(elapsed)
+        self._histogram(self._handler_statements, name, STATEMENT_BUCKETS).observe(statements)
+
+    def observe_api_call(self, method: str, elapsed: float, error: str = None):
+        self._histogram(self._api, method).observe(elapsed)
+        if error is not None:
+            with self._lock:
+                self._api_errors[method, error] += 1
+
+    def gauge(self, name: str, help: str, read: Callable[[], Union[float, dict]]):
+        self._gauges.append((name, help, read))
+
+    def render(self) -> str:
+        lines = []
+        self._render_histograms(lines, 'qgbot_handler_duration_seconds',
+            'Time spent in the update handlers', 'handler', self._handlers)
+        self._render_histograms(lines, 'qgbot_handler_db_statements',
+            'SQL statements made by a single handler call', 'handler', self._handler_statements)
+        if self.query_stats is not None:
+            self._render_histograms(lines, 'qgbot_db_statement_duration_seconds',
+                'Time spent in the SQL statements by the kind of statement', 'kind', self.query_stats.histograms)
+        self._render_histograms(lines, 'qgbot_bot_api_duration_seconds',
+            'Latency of the Bot API calls', 'method', self._api)
+
+        lines.append('# HELP qgbot_bot_api_errors_total Failed Bot API calls')
+        lines.append('# TYPE qgbot_bot_api_errors_total counter')
+        for (method, error), count in sorted(list(self._api_errors.items())):
+            lines.append(f'qgbot_bot_api_errors_total{_labels({"method": method, "error": error})} {count}')
+
+        for name, help, read in self._gauges:
+            try:
+                value = read()
+            except Exception:
+                logger.exception(f'Failed to read the gauge "{name}"')
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    lines.append(f'{name}{_labels(dict(labels))} {_number(v)}')
+            else:
+                lines.append(f'{name} {_number(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, lines: list, name: str, help: str, label: str, histograms: dict):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, histogram in sorted(list(histograms.items())):
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{_labels({label: key, "le": _number(bound)})} {count}')
+            lines.append(f'{name}_sum{_labels({label: key})} {_number(histogram.sum)}')
+            lines.append(f'{name}_count{_labels({label: key})} {histogram.count}')
+
+
+class MetricsServer(ThreadingHTTPServer):
+    '''Serves `GET /metrics` in a background thread'''
+
+    daemon_threads = True
+
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        self.metrics = metrics
+        super().__init__((host, port), _Handler)
+        self._thread = threading.Thread(target=self.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        logger.info(f'Serving the metrics on http://{self.server_address[0]}:{self.server_address[1]}/metrics')
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
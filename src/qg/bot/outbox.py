@@ -0,0 +1,263 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Callable, Hashable, Optional
+
+from telegram.error import RetryAfter
+
+from qg.logger import logger
+
+
+class Priority(IntEnum):
+    '''The lower the value, the sooner the call is made'''
+    URGENT = 0  # answers to the queries, payments
+    NORMAL = 1  # replies to the commands
+    LOW = 2     # edits of the voting messages
+
+
+class TokenBucket(object):
+    '''Allows `rate` calls per second on average with bursts of up to `capacity` calls'''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now) -> float:
+        '''Seconds to wait until the next call is allowed'''
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        '''Deny any calls for the given time (e.g. when Telegram asks to retry later)'''
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Call(object):
+    def __init__(self, seq, priority, rate_key, callback, args, kwargs):
+        self.key = (priority, seq)
+        self.rate_key = rate_key
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = 0
+        # when Telegram has asked to retry the call later
+        self.not_before = 0.0
+        self.future = Future()
+
+    @property
+    def name(self):
+        return getattr(self.callback, '__name__', repr(self.callback))
+
+    @property
+    def global_limited(self) -> bool:
+        '''The global limit of Telegram is on the messages, the answers to the queries aren't counted'''
+        return not (self.key[0] == Priority.URGENT and self.rate_key is None)
+
+
+class Outbox(object):
+    '''
+    Scheduler for the outbound Bot API calls.
+
+    The calls are made by a few background threads, so the handlers don't wait for Telegram.
+    Every chat has its own token bucket and there is a global one as well, so a busy chat can't
+    exhaust the limits of the others. Among the allowed calls the ones with a higher priority are
+    made first, and the ones rejected with `RetryAfter` are postponed for as long as Telegram asks.
+
+    The calls of the same chat are made one at a time, so the ones of the same priority are delivered
+    in the order of submission. The urgent answers to the queries are exempt from the global limit.
+    '''
+
+    MAX_IDLE_BUCKETS = 1024
+
+    def __init__(self, workers=4, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._queue = []
+        # the rate keys of the calls being made right now
+        self._in_flight = set()
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._deadline = None
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f'outbox_{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, callback: Callable, *args, rate_key: Optional[Hashable] = None,
+               priority: Priority = Priority.NORMAL, **kwargs) -> Future:
+        '''
+        Schedule `callback(*args, **kwargs)`, which is supposed to be a Bot API call.
+        `rate_key` defines the rate limit to apply (usually the chat id, but any hashable, e.g. an inline
+        message id, will do), without it only the global limit is applied.
+        '''
+        with self._condition:
+            call = _Call(next(self._seq), priority, rate_key, callback, args, kwargs)
+            if self._stopped:
+                call.future.set_exception(RuntimeError('The outbox is stopped'))
+                return call.future
+            self._queue.append(call)
+            self._condition.notify()
+        return call.future
+
+    def send(self, callback: Callable, *args, **kwargs) -> Future:
+        '''Fire and forget: like `submit` but the failure is only logged'''
+        future = self.submit(callback, *args, **kwargs)
+        name = getattr(callback, '__name__', repr(callback))
+
+        def log_failure(f: Future):
+            if (e := f.exception()) is not None:
+                logger.error(f'Outbound call "{name}" has failed: {e!r}')
+
+        future.add_done_callback(log_failure)
+        return future
+
+    def call(self, callback: Callable, *args, **kwargs):
+        '''Like `submit` but waits for the result (or re-raises the exception)'''
+        return self.submit(callback, *args, **kwargs).result()
+
+    @property
+    def pending(self) -> int:
+        '''Number of calls waiting to be made'''
+        return len(self._queue)
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        '''
+        Make the queued calls (for up to `timeout` seconds) and stop. The calls left by then
+        and the ones submitted afterwards fail with `RuntimeError`, so nobody waits for them forever.
+        '''
+        with self._condition:
+            self._stopped = True
+            if timeout is not None:
+                self._deadline = time.monotonic() + timeout
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _bucket(self, rate_key):
+        if rate_key is None:
+            return None
+        if (bucket := self._chats.get(rate_key)) is None:
+            if len(self._chats) >= self.MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[rate_key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pick(self, now):
+        '''Take the most important call allowed to be made right now or tell how long to wait'''
+        global_delay = self._global.delay(now)
+
+        best, wait = None, None
+        for call in self._queue:
+            if call.rate_key in self._in_flight:
+                # it's going to be notified once the call of the chat is made
+                continue
+            delay = max(global_delay if call.global_limited else 0.0, call.not_before - now)
+            if (bucket := self._bucket(call.rate_key)) is not None:
+                delay = max(delay, bucket.delay(now))
+            if delay == 0:
+                if best is None or call.key < best.key:
+                    best = call
+            else:
+                wait = delay if wait is None else min(wait, delay)
+
+        if best is not None:
+            self._queue.remove(best)
+            if best.global_limited:
+                self._global.take(now)
+            if (bucket := self._bucket(best.rate_key)) is not None:
+                bucket.take(now)
+                self._in_flight.add(best.rate_key)
+        return best, wait
+
+    def _abandon(self):
+        '''Fail the calls left in the queue when the time to stop is up'''
+        for call in self._queue:
+            call.future.set_exception(RuntimeError('The outbox is stopped'))
+        if self._queue:
+            logger.warning(f'{len(self._queue)} outbound calls have been dropped on stop')
+        self._queue.clear()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._stopped and self._deadline is not None and now >= self._deadline:
+                        self._abandon()
+                    if self._stopped and not self._queue:
+                        return
+                    call, wait = self._pick(now)
+                    if call is not None:
+                        break
+                    if self._stopped and self._deadline is not None:
+                        wait = self._deadline - now if wait is None else min(wait, self._deadline - now)
+                    self._condition.wait(wait)
+            self._execute(call)
+
+    def _execute(self, call: _Call):
+        if call.attempts == 0 and not call.future.set_running_or_notify_cancel():
+            self._done(call)
+            return
+
+        try:
+            result = call.callback(*call.args, **call.kwargs)
+        except RetryAfter as e:
+            call.attempts += 1
+            if call.attempts > self.max_retries:
+                self._done(call)
+                call.future.set_exception(e)
+                return
+
+            logger.warning(f'Outbound call "{call.name}" is postponed for {e.retry_after}s')
+            # back to the queue with the same key, so the later calls of the chat don't overtake it
+            self._done(call, retry_after=e.retry_after)
+        except BaseException as e:
+            self._done(call)
+            call.future.set_exception(e)
+        else:
+            self._done(call)
+            call.future.set_result(result)
+
+    def _done(self, call: _Call, retry_after: Optional[float] = None):
+        with self._condition:
+            self._in_flight.discard(call.rate_key)
+            if retry_after is not None:
+                now = time.monotonic()
+                call.not_before = now + retry_after
+                # the limit which has been hit is blocked for the others too,
+                # the answers exempt from the global limit don't hold up the messages
+                if (bucket := self._bucket(call.rate_key)) is not None:
+                    bucket.block(now, retry_after)
+                elif call.global_limited:
+                    self._global.block(now, retry_after)
+                self._queue.append(call)
+            self._condition.notify_all()
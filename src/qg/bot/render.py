@@ -0,0 +1,182 @@
+import threading
+from typing import Optional
+
+from qg.db.users import display_name
+from qg.logger import logger, sampled
+from qg.utils.cache import LRUCache
+from qg.utils.helpers import escape_md, mention_md
+
+# the limit of Telegram on the length of a message (it's applied to the text without the markup,
+# so the MarkdownV2 source is never shorter than what is counted)
+MESSAGE_LIMIT = 4096
+
+_VOTES_TITLE = '\n\n*Votes:*\n'
+_SEPARATOR = ', '
+
+
+class _Voters(object):
+    '''
+    The escaped mentions of the voters on one side in the order they took the side, with their total length.
+    A voter who switches sides goes to the end of the other one, just as `DB.get_voter_mentions` orders them.
+    '''
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.mentions = {}
+        self.length = 0
+
+    def add(self, user_id, mention: str):
+        self.remove(user_id)
+        self.mentions[user_id] = mention
+        self.length += len(mention)
+
+    def remove(self, user_id):
+        if (mention := self.mentions.pop(user_id, None)) is not None:
+            self.length -= len(mention)
+
+    def size(self) -> int:
+        '''Length of the full line'''
+        if not self.mentions:
+            return 0
+        return len(self.prefix) + self.length + len(_SEPARATOR) * (len(self.mentions) - 1) + 1
+
+    def render(self, budget: int) -> str:
+        '''The line with as many voters as fit into `budget` characters and "and N more" for the rest'''
+        if not self.mentions:
+            return ''
+        if self.size() <= budget:
+            return f'{self.prefix}{_SEPARATOR.join(self.mentions.values())}\n'
+
+        shown = []
+        used = len(self.prefix) + 1
+        remaining = len(self.mentions)
+        for mention in self.mentions.values():
+            # the longest possible tail, so that it always fits
+            tail = len(f'{_SEPARATOR}and {remaining} more')
+            if used + len(mention) + len(_SEPARATOR) + tail > budget:
+                break
+            shown.append(mention)
+            used += len(mention) + len(_SEPARATOR)
+            remaining -= 1
+
+        if not shown:
+            return f'{self.prefix}{remaining} voters\n'
+        return f'{self.prefix}{_SEPARATOR.join(shown)}{_SEPARATOR}and {remaining} more\n'
+
+
+class _VoteMessage(object):
+    '''The cached fragments of a single voting message'''
+
+    def __init__(self, header: str, upvotes: int, downvotes: int):
+        self.header = header
+        self.upvotes = upvotes
+        self.downvotes = downvotes
+        self.up = _Voters('✅: ')
+        self.down = _Voters('❌: ')
+
+    def vote(self, user_id, mention: str, upvote: Optional[bool]):
+        if upvote is True:
+            self.down.remove(user_id)
+            self.up.add(user_id, mention)
+        elif upvote is False:
+            self.up.remove(user_id)
+            self.down.add(user_id, mention)
+        else:
+            self.up.remove(user_id)
+            self.down.remove(user_id)
+
+    def apply(self, user_id, mention: str, result):
+        '''Apply a result of `toggle_vote`'''
+        self.vote(user_id, mention, result.upvote)
+        self.upvotes = result.upvotes
+        self.downvotes = result.downvotes
+
+    def render(self) -> str:
+        if not self.up.mentions and not self.down.mentions:
+            return self.header
+
+        budget = MESSAGE_LIMIT - len(self.header) - len(_VOTES_TITLE)
+        # each side gets a half of the budget, and the one which needs less gives the rest to the other
+        up_budget = max(budget // 2, budget - self.down.size())
+        up = self.up.render(up_budget)
+        down = self.down.render(budget - len(up))
+        return self.header + _VOTES_TITLE + up + down
+
+
+class VoteRenderer(object):
+    '''
+    Renders the text of the voting messages from the cached fragments instead of the whole list of votes.
+
+    A message is loaded from the database once, then every vote and revoke updates the escaped mention
+    of a single voter (see `apply`). Only as many mentions as fit into the message limit are joined, the rest
+    is summarized as "and N more", so re-rendering a hot request doesn't depend on the number of its voters.
+
+    A message is loaded without holding the lock, the votes applied to it meanwhile are replayed on top
+    of what has been loaded: they are the results of `toggle_vote` rather than the changes, so replaying
+    the ones the database has returned already is harmless.
+
+    The votes on the same message are handled by the same process (see `qg.bot.cluster`),
+    so the process-local fragments don't go stale.
+    '''
+
+    def __init__(self, db, cache_size=1000):
+        self.db = db
+        self._messages = LRUCache(maxsize=cache_size)
+        # the votes applied to the messages being loaded, by request id
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def apply(self, request_id, user, result):
+        '''Update the cached message (if any) with a result of `toggle_vote` made by the `user`'''
+        mention = mention_md(user.id, display_name(user.username, user.first_name, user.last_name))
+        with self._lock:
+            if (pending := self._loading.get(request_id)) is not None:
+                pending.append((user.id, mention, result))
+            if (message := self._messages.get(request_id)) is not None:
+                message.apply(user.id, mention, result)
+
+    def render(self, request_id) -> Optional[tuple[str, int, int]]:
+        '''(MarkdownV2 text, upvotes, downvotes) of the voting message, or None if there is no such request'''
+        with self._lock:
+            if (message := self._messages.get(request_id)) is not None:
+                return message.render(), message.upvotes, message.downvotes
+            pending = self._loading.setdefault(request_id, [])
+
+        try:
+            loaded = self._load(request_id)
+        finally:
+            with self._lock:
+                if self._loading.get(request_id) is pending:
+                    del self._loading[request_id]
+
+        with self._lock:
+            if (message := self._messages.get(request_id)) is None:
+                if loaded is None:
+                    return None
+                message = loaded
+                for user_id, mention, result in pending:
+                    message.apply(user_id, mention, result)
+                self._messages.put(request_id, message)
+            return message.render(), message.upvotes, message.downvotes
+
+    def forget(self, request_id=None):
+        '''Drop the cached message, or all of them (e.g. after a recount)'''
+        with self._lock:
+            if request_id is None:
+                self._messages.clear()
+            else:
+                self._messages.pop(request_id)
+
+    def _load(self, request_id) -> Optional[_VoteMessage]:
+        with self.db.session():
+            r = self.db.get_request(request_id)
+            if r is None:
+                return None
+
+            message = _VoteMessage(escape_md(f'#{r.category_tag}_request {r.text}'), r.upvotes, r.downvotes)
+            for v in self.db.get_voter_mentions(request_id):
+                message.vote(v.user_id, mention_md(v.user_id, display_name(v.username, v.first_name, v.last_name)), v.upvote)
+
+        if sampled('vote_render'):
+            logger.debug('Loaded {} upvoters and {} downvoters of "{}"', len(message.up.mentions), len(message.down.mentions), request_id)
+        return message
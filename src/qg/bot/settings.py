@@ -21,6 +21,7 @@ class AddAdminConversation(CancellableConversationBuilder):
     def __init__(self, bot):
         self.bot = bot
         self.db = self.bot.db
+        self.outbox = self.bot.outbox
 
     def build_entry_handlers(self):
         return [
@@ -122,6 +123,7 @@ class AddCategoryConversation(CancellableConversationBuilder):
     def __init__(self, bot):
         self.bot = bot
         self.db = self.bot.db
+        self.outbox = self.bot.outbox
         self.max_error_count = 3
 
     def build_entry_handlers(self):
@@ -291,9 +293,8 @@ class SettingsMenu(object):
     def show_categories(self, update: Update, context: CallbackContext):
         '''Print list of categories with the hashtag and URL'''
         response = ''
-        with self.db.session():
-            for tag, (name, url) in self.db.get_categories().items():
-                response += f'{escape_md(f"#{tag}")}: [{escape_md(name)}]({url})\n'
+        for tag, (name, url) in self.db.get_categories().items():
+            response += f'{escape_md(f"#{tag}")}: [{escape_md(name)}]({url})\n'
         update.message.reply_markdown_v2(
             response,
             reply_markup=ReplyKeyboardRemove(),
@@ -1,10 +1,86 @@
+import threading
+import time
+from datetime import timedelta
+
+from dynaconf import settings
 from telegram import ReplyKeyboardRemove, Update
-from telegram.ext import CallbackContext, Dispatcher
+from telegram.ext import CallbackContext, Dispatcher, JobQueue
 
 from qg.logger import logger
 from qg.utils.helpers import escape_md
 
-from .menu import CancelButton, Menu, MenuHandler, MenuItem
+from .menu import BackButton, CancelButton, Menu, MenuHandler, MenuItem
+
+
+def _leaderboard(iterable):
+    return zip(
+        ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟'],
+        iterable
+    )
+
+
+class LeaderboardCache(object):
+    '''
+    Pre-rendered responses of the statistics menu.
+
+    All the leaderboards (all-time, this week and this month) are read in a single session and rendered
+    to MarkdownV2 at once. The result is refreshed in the background every `ttl` seconds, so the clicks
+    on /stats cost nothing. If the background refresh falls behind, the first reader after `ttl` refreshes
+    it and the concurrent readers wait for that instead of querying the database themselves.
+    '''
+
+    WINDOWS = {'all': '', 'week': ' this week', 'month': ' this month'}
+
+    def __init__(self, db, job_queue: JobQueue, ttl: float):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._boards = None
+        self._expires_at = 0.0
+        job_queue.run_repeating(self._refresh_job, interval=ttl, first=0)
+
+    def get(self, name: str, window: str = 'all') -> str:
+        if self._boards is None or self._expires_at < time.monotonic():
+            with self._lock:
+                if self._boards is None or self._expires_at < time.monotonic():
+                    self._refresh()
+        return self._boards[name, window]
+
+    @logger.catch
+    def _refresh_job(self, context: CallbackContext):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        boards = {}
+        with self.db.session():
+            # the date of the database rather than the local one, the timezones of the two may differ
+            today = self.db.get_today()
+            since = {
+                'all': None,
+                'week': today - timedelta(days=today.weekday()),
+                'month': today.replace(day=1)
+            }
+
+            for window, title in self.WINDOWS.items():
+                boards['committers', window] = f'Here are the people who make the biggest amount of proposals{title}:\n' + '\n'.join([
+                    f'''{n} {user.mention_md()} {escape_md(f'({count} submission{"s" if count != 1 else ""})')}'''
+                    for n, (user, count) in _leaderboard(self.db.get_top_committers(since=since[window]))
+                ])
+                boards['reviewers', window] = f'Here are the people who vote the most{title}:\n' + '\n'.join([
+                    f'''{n} {user.mention_md()} {escape_md(f'({count} vote{"s" if count != 1 else ""})')}'''
+                    for n, (user, count) in _leaderboard(self.db.get_top_reviewers(since=since[window]))
+                ])
+                boards['influencers', window] = f'Here are the people whose proposals got the highest amount of upvotes{title or " in total"}:\n' + '\n'.join([
+                    f'{n} {user.mention_md()} got {upvotes} upvote{"s" if upvotes != 1 else ""}'
+                    for n, (user, upvotes) in _leaderboard(self.db.get_best_committers(since=since[window]))
+                ])
+                boards['categories', window] = f'Here are the categories with the most proposals{title}:\n' + '\n'.join([
+                    f'''{n} {escape_md(category.name)} {escape_md(f'({count} submission{"s" if count != 1 else ""})')}'''
+                    for n, (category, count) in _leaderboard(self.db.get_top_categories(since=since[window]))
+                ])
+        self._boards = boards
+        self._expires_at = time.monotonic() + self.ttl
 
 
 class StatisticsMenu(object):
@@ -13,62 +89,52 @@ class StatisticsMenu(object):
     def __init__(self, bot, dispatcher: Dispatcher):
         self.bot = bot
         self.db = self.bot.db
+        self.leaderboards = LeaderboardCache(self.db, dispatcher.job_queue, settings.BOT.stats_ttl)
         self.menu = MenuHandler(self.build_menu(), dispatcher=dispatcher)
 
-    def _leaderboard(self, iterable):
-        return zip(
-            ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟'],
-            iterable
-        )
-
     def build_menu(self):
         menu = Menu('stats', 'Here are the TOP-5s. What do you want to see?',
         [
             [ MenuItem('Top Committers', self.show_top_committers) ],
             [ MenuItem('Top Reviewers', self.show_top_reviewers) ],
             [ MenuItem('Top Influencers', self.show_best_committers) ],
+            [ self._build_window_menu('This week', 'week'), self._build_window_menu('This month', 'month') ],
             [ CancelButton() ]
         ])
         return menu
 
-    @logger.catch
-    def show_top_committers(self, update: Update, context: CallbackContext):
-        response = 'Here are the people who make the biggest amount of proposals:\n'
-        with self.db.session():
-            response += '\n'.join([
-                f'''{n} {user.mention_md()} {escape_md(f'({count} submission{"s" if count != 1 else ""})')}'''
-                for n, (user, count) in self._leaderboard(self.db.get_top_committers())
-            ])
+    def _build_window_menu(self, name: str, window: str):
+        suffix = name.lower()
+        return Menu(name, f'Who is the best {suffix}?',
+        [
+            [ MenuItem(f'Committers {suffix}', self._show(window, 'committers')) ],
+            [ MenuItem(f'Reviewers {suffix}', self._show(window, 'reviewers')) ],
+            [ MenuItem(f'Influencers {suffix}', self._show(window, 'influencers')) ],
+            [ MenuItem(f'Categories {suffix}', self._show(window, 'categories')) ],
+            [ CancelButton(), BackButton() ]
+        ])
+
+    def _reply(self, update: Update, board: str, window: str = 'all'):
         update.message.reply_markdown_v2(
-            response,
+            self.leaderboards.get(board, window),
             reply_markup=ReplyKeyboardRemove()
         )
         return Menu.States.STOPPING
 
+    def _show(self, window: str, board: str):
+        @logger.catch
+        def show(update: Update, context: CallbackContext):
+            return self._reply(update, board, window)
+        return show
+
+    @logger.catch
+    def show_top_committers(self, update: Update, context: CallbackContext):
+        return self._reply(update, 'committers')
+
     @logger.catch
     def show_top_reviewers(self, update: Update, context: CallbackContext):
-        response = 'Here are the people who vote the most:\n'
-        with self.db.session():
-            response += '\n'.join([
-                f'''{n} {user.mention_md()} {escape_md(f'({count} vote{"s" if count != 1 else ""})')}'''
-                for n, (user, count) in self._leaderboard(self.db.get_top_reviewers())
-            ])
-        update.message.reply_markdown_v2(
-            response,
-            reply_markup=ReplyKeyboardRemove()
-        )
-        return Menu.States.STOPPING
+        return self._reply(update, 'reviewers')
 
     @logger.catch
     def show_best_committers(self, update: Update, context: CallbackContext):
-        response = 'Here are the people whose proposals got the highest amount of upvotes in total:\n'
-        with self.db.session():
-            response += '\n'.join([
-                f'{n} {user.mention_md()} got {upvotes} upvote{"s" if upvotes != 1 else ""}'
-                for n, (user, upvotes) in self._leaderboard(self.db.get_best_committers())
-            ])
-        update.message.reply_markdown_v2(
-            response,
-            reply_markup=ReplyKeyboardRemove()
-        )
-        return Menu.States.STOPPING
+        return self._reply(update, 'influencers')
@@ -1,8 +1,10 @@
 from .common import Base
-from .db import DB
+from .db import DB, DuplicateUpdate
 
 from .categories import Category
 from .donations import Donation
+from .inbox import InboxUpdate, ProcessedUpdate
 from .requests import Request
+from .rollups import CategoryDailyStats, UserDailyStats
 from .users import User
 from .votes import Vote
@@ -0,0 +1,95 @@
+from qg.logger import logger, sampled
+
+from .db import (DuplicateUpdate, VoteToggle, _claim_update_statement, _count_request_rollups_statements,
+                 _count_request_statement, _current_vote_statement, _lock_request_statement,
+                 _toggle_vote_statement, _upsert_user_statement)
+from .requests import Request
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # SQLAlchemy < 1.4
+    create_async_engine = None
+
+
+class AsyncDB(object):
+    '''
+    Asynchronous counterpart of the hot path of `DB` (the requests and the votes) on an asyncio engine.
+
+    Shares the statements and the process-local caches with the synchronous `DB`,
+    which is still used for everything else (the settings conversations, the statistics, etc.).
+    Requires SQLAlchemy 1.4+ and asyncpg.
+    '''
+
+    def __init__(self, db, pool_size=None, max_overflow=None, statement_timeout=None):
+        if create_async_engine is None:
+            raise RuntimeError('The asyncio mode requires SQLAlchemy 1.4+ and asyncpg')
+
+        self.db = db
+        engine_options = {'pool_pre_ping': True}
+        if pool_size is not None:
+            engine_options['pool_size'] = pool_size
+        if max_overflow is not None:
+            engine_options['max_overflow'] = max_overflow
+        if statement_timeout is not None:
+            engine_options['connect_args'] = {
+                'server_settings': {'statement_timeout': str(int(statement_timeout * 1000))}
+            }
+        self.engine = create_async_engine(db.engine.url.set(drivername='postgresql+asyncpg'), **engine_options)
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+    async def _upsert_user(self, connection, user):
+        '''See `DB._upsert_user`'''
+        if self.db._is_known_user(user):
+            return user.id
+
+        await connection.execute(_upsert_user_statement(user))
+        logger.debug('User {} has been added or updated', user.id)
+        return user.id
+
+    async def _claim_update(self, connection, update_id):
+        '''See `DB._claim_update`, the transaction is rolled back by the exception'''
+        if update_id is not None and (await connection.execute(_claim_update_statement(update_id))).first() is None:
+            raise DuplicateUpdate(update_id)
+
+    async def add_request(self, request_id, user, category_tag, text, update_id=None):
+        '''See `DB.add_request`'''
+        async with self.engine.begin() as connection:
+            user_id = await self._upsert_user(connection, user)
+            await self._claim_update(connection, update_id)
+            await connection.execute(
+                Request.__table__.insert().values(
+                    id=request_id,
+                    user_id=user_id,
+                    category_tag=category_tag,
+                    text=text
+                )
+            )
+            await connection.execute(_count_request_statement(user_id))
+            for statement in _count_request_rollups_statements(user_id, category_tag):
+                await connection.execute(statement)
+        self.db._remember_user(user)
+        logger.debug('New request "{}" has been registered by the user {}', request_id, user_id)
+
+    async def toggle_vote(self, request_id, user, upvote, update_id=None):
+        '''See `DB.toggle_vote`'''
+        async with self.engine.connect() as connection:
+            async with connection.begin() as transaction:
+                user_id = await self._upsert_user(connection, user)
+                await self._claim_update(connection, update_id)
+
+                request = (await connection.execute(_lock_request_statement(request_id))).first()
+                if request is None:
+                    await transaction.rollback()
+                    return None
+
+                category_tag, request_text = request
+                previous = (await connection.execute(_current_vote_statement(request_id, user_id))).scalar()
+                statement, params, new = _toggle_vote_statement(request_id, user_id, previous, upvote)
+                upvotes, downvotes = (await connection.execute(statement, params)).first()
+
+        self.db._remember_user(user)
+        if sampled('vote'):
+            logger.debug('Vote on "{}" by the user {} has been changed from {} to {}', request_id, user_id, previous, new)
+        return VoteToggle(new, upvotes, downvotes, category_tag, request_text)
@@ -1,32 +1,324 @@
-from datetime import datetime
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import MappingProxyType
 from uuid import uuid4
 
-from qg.logger import logger
-from sqlalchemy import create_engine, func
+from qg.logger import logger, sampled
+from qg.utils.cache import LRUCache, TTLCache
+from sqlalchemy import and_, create_engine, func, select, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy.orm.exc import NoResultFound
 
+from . import migrations
 from .categories import Category
-from .common import Base
 from .donations import Donation
+from .inbox import InboxUpdate, ProcessedUpdate
+from .instrumentation import QueryStats
 from .requests import Request
+from .rollups import CategoryDailyStats, UserDailyStats
 from .users import User
 from .votes import Vote
 
+VoteToggle = namedtuple('VoteToggle', ['upvote', 'upvotes', 'downvotes', 'category_tag', 'text'])
+
+
+class DuplicateUpdate(Exception):
+    '''The update has been handled already, see `qg.bot.dedupe`. Nothing has been written.'''
+
+    def __init__(self, update_id):
+        super().__init__(f'The update {update_id} has been handled already')
+        self.update_id = update_id
+
+
+_TALLIES_SQL = f'''
+UPDATE "{Request.__tablename__}"
+SET upvotes = upvotes + :up, downvotes = downvotes + :down
+WHERE id = :request_id
+RETURNING upvotes, downvotes
+'''
+
+# a single UPDATE for both the voter and the author, as they may be the same row
+_USER_COUNTERS_CTE = f'''
+user_counters AS (
+    UPDATE "{User.__tablename__}"
+    SET votes_count = votes_count + CASE WHEN "{User.__tablename__}".id = :user_id THEN :votes ELSE 0 END,
+        upvotes_received = upvotes_received + CASE WHEN "{User.__tablename__}".id = author.user_id THEN :up ELSE 0 END
+    FROM (SELECT user_id FROM "{Request.__tablename__}" WHERE id = :request_id) AS author
+    WHERE "{User.__tablename__}".id IN (:user_id, author.user_id)
+)'''
+
+# the changes are accounted on the day the vote was cast, the rows are pre-aggregated
+# as the voter and the author may be the same user
+_ROLLUPS_CTE = f'''
+user_rollups AS (
+    INSERT INTO "{UserDailyStats.__tablename__}" AS stats (day, user_id, votes, upvotes_received)
+    SELECT CAST(vote.created_at AS DATE), delta.user_id, sum(delta.votes), sum(delta.upvotes_received)
+    FROM vote, (
+        SELECT CAST(:user_id AS INTEGER) AS user_id, CAST(:votes AS INTEGER) AS votes, 0 AS upvotes_received
+        UNION ALL
+        SELECT user_id, 0, CAST(:up AS INTEGER)
+        FROM "{Request.__tablename__}" WHERE id = :request_id AND user_id IS NOT NULL
+    ) AS delta
+    GROUP BY 1, 2
+    ON CONFLICT (day, user_id) DO UPDATE
+    SET votes = stats.votes + excluded.votes,
+        upvotes_received = stats.upvotes_received + excluded.upvotes_received
+),
+category_rollups AS (
+    INSERT INTO "{CategoryDailyStats.__tablename__}" AS stats (day, category_tag, upvotes, downvotes)
+    SELECT CAST(vote.created_at AS DATE), request.category_tag, CAST(:up AS INTEGER), CAST(:down AS INTEGER)
+    FROM vote, "{Request.__tablename__}" AS request
+    WHERE request.id = :request_id AND request.category_tag IS NOT NULL
+    ON CONFLICT (day, category_tag) DO UPDATE
+    SET upvotes = stats.upvotes + excluded.upvotes,
+        downvotes = stats.downvotes + excluded.downvotes
+)'''
+
+_CAST_VOTE_SQL = text(f'''
+WITH vote AS (
+    INSERT INTO "{Vote.__tablename__}" (request_id, user_id, upvote)
+    VALUES (:request_id, :user_id, :upvote)
+    ON CONFLICT (request_id, user_id) DO UPDATE SET upvote = excluded.upvote, changed_at = now()
+    RETURNING created_at
+),{_USER_COUNTERS_CTE},{_ROLLUPS_CTE}
+{_TALLIES_SQL}''')
+
+_REVOKE_VOTE_SQL = text(f'''
+WITH vote AS (
+    DELETE FROM "{Vote.__tablename__}"
+    WHERE request_id = :request_id AND user_id = :user_id
+    RETURNING created_at
+),{_USER_COUNTERS_CTE},{_ROLLUPS_CTE}
+{_TALLIES_SQL}''')
+
+_REBUILD_ROLLUPS_SQL = [
+    text(f'DELETE FROM "{UserDailyStats.__tablename__}"'),
+    text(f'DELETE FROM "{CategoryDailyStats.__tablename__}"'),
+    text(f'''
+INSERT INTO "{UserDailyStats.__tablename__}" (day, user_id, requests, votes, upvotes_received)
+SELECT day, user_id, sum(requests), sum(votes), sum(upvotes_received)
+FROM (
+    SELECT CAST(created_at AS DATE) AS day, user_id, 1 AS requests, 0 AS votes, 0 AS upvotes_received
+    FROM "{Request.__tablename__}" WHERE user_id IS NOT NULL
+    UNION ALL
+    SELECT CAST(created_at AS DATE), user_id, 0, 1, 0
+    FROM "{Vote.__tablename__}"
+    UNION ALL
+    SELECT CAST(vote.created_at AS DATE), request.user_id, 0, 0, 1
+    FROM "{Vote.__tablename__}" AS vote JOIN "{Request.__tablename__}" AS request ON request.id = vote.request_id
+    WHERE vote.upvote AND request.user_id IS NOT NULL
+) AS totals
+GROUP BY day, user_id'''),
+    text(f'''
+INSERT INTO "{CategoryDailyStats.__tablename__}" (day, category_tag, requests, upvotes, downvotes)
+SELECT day, category_tag, sum(requests), sum(upvotes), sum(downvotes)
+FROM (
+    SELECT CAST(created_at AS DATE) AS day, category_tag, 1 AS requests, 0 AS upvotes, 0 AS downvotes
+    FROM "{Request.__tablename__}" WHERE category_tag IS NOT NULL
+    UNION ALL
+    SELECT CAST(vote.created_at AS DATE), request.category_tag, 0,
+           CASE WHEN vote.upvote THEN 1 ELSE 0 END, CASE WHEN vote.upvote THEN 0 ELSE 1 END
+    FROM "{Vote.__tablename__}" AS vote JOIN "{Request.__tablename__}" AS request ON request.id = vote.request_id
+    WHERE request.category_tag IS NOT NULL
+) AS totals
+GROUP BY day, category_tag''')
+]
+
+# the next batch of a shard of the inbox, unless a batch of it is still being handled by someone
+# (so that the shard is handled in order), see `DB.lease_updates`; the batch is an array rather than
+# an IN subquery, so that its rows are updated by the primary key instead of hashing the whole inbox
+_LEASE_UPDATES_SQL = text(f'''
+UPDATE "{InboxUpdate.__tablename__}"
+SET leased_until = now() + :lease * interval '1 second', attempts = attempts + 1
+WHERE id = ANY(ARRAY(
+    SELECT id FROM "{InboxUpdate.__tablename__}"
+    WHERE shard = :shard AND NOT EXISTS (
+        SELECT 1 FROM "{InboxUpdate.__tablename__}" WHERE shard = :shard AND leased_until >= now()
+    )
+    ORDER BY id
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+))
+RETURNING id, payload, attempts''')
+
+
+def _upsert_user_statement(user):
+    statement = insert(User).values(
+        id=user.id,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        username=user.username
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[User.id],
+        set_={
+            'first_name': statement.excluded.first_name,
+            'last_name': statement.excluded.last_name,
+            'username': statement.excluded.username
+        }
+    )
+
+
+def _count_request_statement(user_id):
+    return (
+        User.__table__.update()
+        .where(User.id == user_id)
+        .values(requests_count=User.requests_count + 1)
+    )
+
+
+def _count_request_rollups_statements(user_id, category_tag):
+    '''Statements which account a new request in today's totals of its author and its category'''
+    statements = [_user_rollups_statement(func.current_date(), {user_id: {'requests': 1}})]
+    if category_tag is not None:
+        statements.append(_category_rollups_statement(func.current_date(), category_tag, requests=1))
+    return statements
+
+
+def _user_rollups_statement(day, deltas):
+    '''Add `deltas` ({user_id: {column: delta}}) to the daily totals of the users'''
+    statement = insert(UserDailyStats).values([
+        {'day': day, 'user_id': user_id, 'requests': 0, 'votes': 0, 'upvotes_received': 0} | delta
+        for user_id, delta in deltas.items()
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=[UserDailyStats.day, UserDailyStats.user_id],
+        set_={
+            column: getattr(UserDailyStats, column) + getattr(statement.excluded, column)
+            for column in ('requests', 'votes', 'upvotes_received')
+        }
+    )
+
+
+def _category_rollups_statement(day, category_tag, requests=0, upvotes=0, downvotes=0):
+    '''Add the deltas to the daily totals of the category'''
+    statement = insert(CategoryDailyStats).values(
+        day=day,
+        category_tag=category_tag,
+        requests=requests,
+        upvotes=upvotes,
+        downvotes=downvotes
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[CategoryDailyStats.day, CategoryDailyStats.category_tag],
+        set_={
+            column: getattr(CategoryDailyStats, column) + getattr(statement.excluded, column)
+            for column in ('requests', 'upvotes', 'downvotes')
+        }
+    )
+
+
+def _lock_request_statement(request_id):
+    '''Select the Request and lock it'''
+    return (
+        select([Request.category_tag, Request.text])
+        .where(Request.id == request_id)
+        .with_for_update()
+    )
+
+
+def _current_vote_statement(request_id, user_id):
+    '''
+    Select the current vote of the User on the Request. It has to be a separate statement executed after
+    `_lock_request_statement`: only a new statement sees a vote committed while waiting for the lock.
+    '''
+    return select([Vote.upvote]).where(and_(Vote.request_id == request_id, Vote.user_id == user_id))
+
+
+def _claim_update_statement(update_id):
+    '''
+    Record the update as handled. Returns a row only if it hasn't been recorded yet,
+    a concurrent claim of the same update waits for the first one to commit or roll back.
+    '''
+    return (
+        insert(ProcessedUpdate)
+        .values(update_id=update_id)
+        .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+        .returning(ProcessedUpdate.update_id)
+    )
+
+
+def _prune_processed_updates_statement(ttl):
+    '''Delete the records of the updates handled more than `ttl` seconds ago'''
+    return (
+        ProcessedUpdate.__table__.delete()
+        .where(ProcessedUpdate.processed_at < func.now() - timedelta(seconds=ttl))
+    )
+
+
+def _ack_updates_statement(ids):
+    '''Delete the handled updates from the inbox'''
+    return InboxUpdate.__table__.delete().where(InboxUpdate.id.in_(ids))
+
+
+def _toggle_vote_statement(request_id, user_id, previous, upvote):
+    '''
+    The statement (with its parameters) which writes the vote toggled from `previous` by a click on `upvote`
+    and updates the counters. Returns the new counters when executed.
+    '''
+    new = None if previous == upvote else upvote
+    params = {
+        'request_id': request_id,
+        'user_id': user_id,
+        'upvote': upvote,
+        'up': int(new is True) - int(previous is True),
+        'down': int(new is False) - int(previous is False),
+        'votes': int(new is not None) - int(previous is not None)
+    }
+    return (_REVOKE_VOTE_SQL if new is None else _CAST_VOTE_SQL), params, new
+
 
 class DB(object):
-    def __init__(self, user='', password='', db='', host='localhost', port=5432, *, full_uri='', echo=False):
+    def __init__(self, user='', password='', db='', host='localhost', port=5432, *, full_uri='', echo=False,
+                 known_users=10000, admin_cache_ttl=60, category_cache_ttl=None,
+                 pool_size=None, max_overflow=None, pool_pre_ping=False, pool_recycle=-1,
+                 statement_timeout=None, slow_query_threshold=None):
+        '''
+        `statement_timeout` and `slow_query_threshold` are in seconds. The pool options are passed
+        to `create_engine` as is (only if specified). The migrations and the recounts are not subject
+        to `statement_timeout`.
+
+        `category_cache_ttl` (in seconds) makes the category catalog expire, which is needed when
+        several processes share the database: a change made by one of them isn't seen by the others.
+        '''
+        engine_options = {
+            'echo': echo,
+            'pool_pre_ping': pool_pre_ping,
+            'pool_recycle': pool_recycle
+        }
+        if pool_size is not None:
+            engine_options['pool_size'] = pool_size
+        if max_overflow is not None:
+            engine_options['max_overflow'] = max_overflow
+        if statement_timeout is not None:
+            engine_options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout * 1000)}'}
+
         if full_uri:
-            self.engine = create_engine(full_uri, echo=echo)
+            self.engine = create_engine(full_uri, **engine_options)
         else:
             self.engine = create_engine(
                 f'postgresql://{user}:{password}@{host}:{port}/{db}',
-                echo=echo
+                **engine_options
             )
+        self.query_stats = QueryStats(self.engine, slow_query_threshold)
 
         self.session_factory = sessionmaker(bind=self.engine)
         self.scoped_session = scoped_session(self.session_factory)
 
+        # process-local category catalog, see `get_categories`
+        self._categories = None
+        self._categories_lock = threading.Lock()
+        self._categories_ttl = category_cache_ttl
+        self._categories_expire_at = 0.0
+
+        # ids of the users who are known to be in the database along with a hash of their profiles
+        self._known_users = LRUCache(maxsize=known_users)
+
+        # admin status of the users, see `is_admin`
+        self._admins = TTLCache(ttl=admin_cache_ttl, maxsize=known_users)
+
     def start_session(self):
         return self.scoped_session()
 
@@ -43,31 +335,13 @@ class DB(object):
         return _DbSession()
 
     def create_all(self, admins=[], categories=[]):
-        logger.info('Creating the database scheme…')
-        Base.metadata.create_all(self.engine)
-        logger.success('Done.')
-
-        s = self.start_session()
-
-        logger.info('Pre-filling the admins…')
-        for admin in admins:
-            s.merge(User(**admin, is_admin=True))
-        s.commit()
-        logger.success('Done.')
-
-        logger.info('Pre-filling the categories…')
-        for category in categories:
-            s.merge(Category(**category))
-        s.commit()
-        logger.success('Done.')
-
-        self.end_session()
-
-    def _get_user(self, user_id):
-        '''Get a User by id or raise an exception otherwise'''
-        s = self.start_session()
-        logger.info(f'Looking for a user with id "{user_id}')
-        return s.query(User).filter(User.id == user_id).one()
+        '''
+        Bring the database schema up to date and seed the admins and the categories,
+        see `qg.db.migrations`. Costs a single query if nothing has changed since the last start.
+        '''
+        if migrations.migrate(self, admins, categories):
+            self._admins.clear()
+            self._invalidate_categories()
 
     def add_user(self, id, first_name, last_name=None, username=None, is_admin=False):
         '''Add user (overwriting fields if it's already in the database)'''
@@ -81,23 +355,33 @@ class DB(object):
         )
         s.merge(new_user)
         s.commit()
+        self._known_users.pop(id)
+        self._admins.pop(id)
         logger.success(f'User has been added: {new_user}')
         return new_user
 
-    def _get_or_add_user(self, id, first_name, last_name=None, username=None, is_admin=False):
-        try:
-            user = self._get_user(id)
-            logger.info('User has been found')
-        except NoResultFound:
-            logger.warning('No such user has been found in the database. Adding…')
-            user = self.add_user(
-                id=id,
-                first_name=first_name,
-                last_name=last_name,
-                username=username,
-                is_admin=is_admin
-            )
-        return user
+    def _upsert_user(self, user):
+        '''
+        Make sure the Telegram user is in the database and the profile there is up to date.
+        Repeat visitors with unchanged profiles cost no queries at all, otherwise it's a single upsert.
+        Returns the user's id.
+        '''
+        if self._is_known_user(user):
+            return user.id
+
+        s = self.start_session()
+        s.execute(_upsert_user_statement(user))
+        s.commit()
+        logger.debug('User {} has been added or updated', user.id)
+
+        self._remember_user(user)
+        return user.id
+
+    def _is_known_user(self, user):
+        return self._known_users.get(user.id) == hash((user.first_name, user.last_name, user.username))
+
+    def _remember_user(self, user):
+        self._known_users.put(user.id, hash((user.first_name, user.last_name, user.username)))
 
     def find_user(self, user_id):
         '''Get a User by id or None otherwise'''
@@ -109,6 +393,19 @@ class DB(object):
         s = self.start_session()
         return s.query(User).filter(User.username == username).one_or_none()
 
+    def is_admin(self, user_id):
+        '''
+        Check if the User is admin (unknown users are not).
+        The answer is cached for a while, so most of the checks don't touch the database.
+        '''
+        if (is_admin := self._admins.get(user_id)) is not None:
+            return is_admin
+
+        s = self.start_session()
+        is_admin = bool(s.query(User.is_admin).filter(User.id == user_id).scalar())
+        self._admins.put(user_id, is_admin)
+        return is_admin
+
     def get_admins(self):
         '''Get admin Users ordered by names'''
         s = self.start_session()
@@ -120,6 +417,7 @@ class DB(object):
         admin_but_not_for_long = s.query(User).get(user_id)
         admin_but_not_for_long.is_admin = False
         s.commit()
+        self._admins.pop(user_id)
         logger.success(f'User {admin_but_not_for_long} is not admin anymore.')
 
     def add_category(self, tag, name, url):
@@ -128,6 +426,7 @@ class DB(object):
         new_category = Category(tag=tag, name=name, url=url)
         s.merge(new_category)
         s.commit()
+        self._invalidate_categories()
         logger.success(f'Category is added: {new_category}')
 
     def remove_category(self, category_id):
@@ -136,176 +435,267 @@ class DB(object):
         category = s.query(Category).get(category_id)
         s.delete(category)
         s.commit()
+        self._invalidate_categories()
         logger.success(f'Category "{category_id}" is removed.')
 
     def get_categories(self):
         '''
-        Return a dictionary where every key is a hashtag and
-        every value is a tuple of a name and a playlist URL
-        '''
-        s = self.start_session()
-        return {
-            tag: (name, url)
-            for tag, name, url in s.query(Category.tag, Category.name, Category.url).order_by(Category.name)
-        }
+        Return a read-only mapping where every key is a hashtag and
+        every value is a tuple of a name and a playlist URL.
 
-    def add_request(self, request_id, user, category_tag, text):
+        The catalog is loaded from the database once and then served from memory
+        until a category is added or removed (or until it expires, see `category_cache_ttl`).
+        '''
+        if (categories := self._categories) is not None and not self._categories_expired():
+            return categories
+
+        with self._categories_lock:
+            if self._categories is None or self._categories_expired():
+                self._categories = self._load_categories()
+                if self._categories_ttl is not None:
+                    self._categories_expire_at = time.monotonic() + self._categories_ttl
+            return self._categories
+
+    def _categories_expired(self):
+        return self._categories_ttl is not None and self._categories_expire_at < time.monotonic()
+
+    def _load_categories(self):
+        logger.info('Loading the category catalog…')
+        # a short-lived session of its own, so the catalog can be (re)loaded from anywhere
+        s = self.session_factory()
+        try:
+            return MappingProxyType({
+                tag: (name, url)
+                for tag, name, url in s.query(Category.tag, Category.name, Category.url).order_by(Category.name)
+            })
+        finally:
+            s.close()
+
+    def _invalidate_categories(self):
+        with self._categories_lock:
+            self._categories = None
+
+    def add_request(self, request_id, user, category_tag, text, update_id=None):
         '''
         Create new Request for voting.
         If a creator of the request is not yet in the database,
         s/he is added along with the request.
+
+        With `update_id`, the update is claimed in the same transaction (see `_claim_update`).
         '''
         s = self.start_session()
-        u = self._get_or_add_user(user.id, user.first_name, user.last_name, user.username)
+        user_id = self._upsert_user(user)
+        self._claim_update(update_id)
 
         request = Request(
             id=request_id,
-            user_id=u.id,
+            user_id=user_id,
             category_tag=category_tag,
             text=text
         )
         s.add(request)
+        s.execute(_count_request_statement(user_id))
+        for statement in _count_request_rollups_statements(user_id, category_tag):
+            s.execute(statement)
         s.commit()
-        logger.success(f'New request has been registered: {request}')
-
-    def add_vote(self, request_id, user, upvote):
-        '''
-        Add a Vote for a particular request (overwriting previous value).
-        If a person who left the vote is not yet in the database,
-        s/he is added along with the request.
-        '''
-        s = self.start_session()
-        u = self._get_or_add_user(user.id, user.first_name, user.last_name, user.username)
-
-        vote = Vote(
-            request_id=request_id,
-            user_id=u.id,
-            upvote=upvote
-        )
-        s.merge(vote)
-        s.commit()
-        logger.success(f'New vote has been registered: {vote}')
+        logger.debug('New request "{}" has been registered by the user {}', request_id, user_id)
 
     def get_request(self, id):
         '''Get Request by id or None otherwise'''
         s = self.start_session()
         return s.query(Request).get(id)
 
-    def has_voted(self, request_id, user, vote):
-        '''Check if there is a Vote on this Request by this User in the database'''
-        s = self.start_session()
-        return (
-            s.query(Vote)
-            .filter(Vote.request_id == request_id,
-                    Vote.user_id == user.id,
-                    Vote.upvote == vote)
-            .count()
-        ) > 0
-
-    def revoke_vote(self, request_id, user):
-        '''Remove the vote by the User on the particular Request'''
+    def toggle_vote(self, request_id, user, upvote, update_id=None):
+        '''
+        Cast the vote or take it back if the User has already voted the same way.
+
+        The Request row is locked first, so the concurrent clicks on the same message are applied
+        one after another. Then the current vote is read (by a statement of its own, so that it includes
+        the vote of a click which held the lock before), and the new one is written and the counters
+        are updated by a single statement.
+        Returns `VoteToggle` with the new vote of the User (None if revoked) and the new counters,
+        or None if there is no such Request.
+
+        With `update_id`, the update is claimed in the same transaction (see `_claim_update`).
+        '''
         s = self.start_session()
-        s.query(Vote).filter(Vote.request_id == request_id, Vote.user_id == user.id).delete()
+        user_id = self._upsert_user(user)
+        self._claim_update(update_id)
+
+        request = s.execute(_lock_request_statement(request_id)).first()
+        if request is None:
+            s.rollback()
+            return None
+
+        category_tag, request_text = request
+        previous = s.execute(_current_vote_statement(request_id, user_id)).scalar()
+        statement, params, new = _toggle_vote_statement(request_id, user_id, previous, upvote)
+        upvotes, downvotes = s.execute(statement, params).first()
         s.commit()
-        logger.success(f'Vote on message "{request_id}" by the user "{user}" has been removed')
 
-    def get_votes(self, request_id):
-        '''Get all Votes on a single Request grouped by vote results'''
+        if sampled('vote'):
+            logger.debug('Vote on "{}" by the user {} has been changed from {} to {}', request_id, user_id, previous, new)
+        return VoteToggle(new, upvotes, downvotes, category_tag, request_text)
+
+    def _claim_update(self, update_id):
+        '''
+        Record the update as handled as a part of the current transaction, so it's recorded only if the rest
+        of the handler's writes are committed. Rolls back and raises `DuplicateUpdate` if it's recorded already.
+        '''
+        if update_id is None:
+            return
         s = self.start_session()
-        return s.query(Vote).filter(Vote.request_id == request_id).order_by(Vote.upvote)
+        if s.execute(_claim_update_statement(update_id)).first() is None:
+            s.rollback()
+            raise DuplicateUpdate(update_id)
 
-    def get_top_reviewers(self):
-        '''Get Users with maximum numbers of Votes'''
+    def recount_votes(self, request_id=None):
+        '''
+        Recalculate the vote counters of a single Request (or all of them) from the Votes.
+        Returns the number of updated requests.
+        '''
         s = self.start_session()
+        if self.engine.dialect.name == 'postgresql':
+            # a full recount goes through all the votes, which takes longer than `statement_timeout`
+            s.execute(text('SET LOCAL statement_timeout = 0'))
+
+        def count(upvote):
+            return (
+                s.query(func.count(Vote.user_id))
+                .filter(Vote.request_id == Request.id, Vote.upvote == upvote)
+                .as_scalar()
+            )
 
-        # Count votes
-        votes = (
-            s.query(
-                Vote.user_id,
-                func.count('*').label('votes_count'))
-            .group_by(Vote.user_id)
-            .limit(5)
-        ).subquery()
+        requests = s.query(Request)
+        if request_id is not None:
+            requests = requests.filter(Request.id == request_id)
+        updated = requests.update({
+            Request.upvotes: count(True),
+            Request.downvotes: count(False)
+        }, synchronize_session=False)
+        if request_id is None:
+            self._recount_user_counters()
+            for statement in _REBUILD_ROLLUPS_SQL:
+                s.execute(statement)
+        s.commit()
+        logger.success(f'Votes have been recounted on {updated} request(s).')
+        return updated
 
-        # Return user info
+    def _recount_user_counters(self):
+        '''Recalculate the leaderboard counters of all Users. Doesn't commit.'''
+        s = self.start_session()
+        s.query(User).update({
+            User.requests_count: (
+                s.query(func.count(Request.id))
+                .filter(Request.user_id == User.id)
+                .as_scalar()),
+            User.votes_count: (
+                s.query(func.count(Vote.request_id))
+                .filter(Vote.user_id == User.id)
+                .as_scalar()),
+            User.upvotes_received: (
+                s.query(func.count(Vote.user_id))
+                .join(Request, Request.id == Vote.request_id)
+                .filter(Request.user_id == User.id, Vote.upvote == True)
+                .as_scalar())
+        }, synchronize_session=False)
+
+    def get_voter_mentions(self, request_id):
+        '''
+        Get (upvote, user_id, username, first_name, last_name) of every voter on a single Request
+        with a single query, in the order they took their current sides
+        '''
+        s = self.start_session()
         return (
             s.query(
-                User,
-                votes.c.votes_count)
-            .join(votes, User.id == votes.c.user_id)
-            .order_by(
-                votes.c.votes_count.desc(),
+                Vote.upvote,
+                User.id.label('user_id'),
                 User.username,
-                User.first_name)
+                User.first_name,
+                User.last_name)
+            .join(User, User.id == Vote.user_id)
+            .filter(Vote.request_id == request_id)
+            .order_by(Vote.changed_at, Vote.user_id)
         )
 
-    def get_top_committers(self):
-        '''Get Users with maximum number of requests'''
-        s = self.start_session()
+    def get_top_reviewers(self, limit=5, since=None):
+        '''Get Users with maximum numbers of Votes (cast since the date, if any) along with the numbers'''
+        return self._get_top_users(User.votes_count, UserDailyStats.votes, limit, since)
 
-        # Count requests
-        requests = (
-            s.query(
-                Request.user_id,
-                func.count('*').label('requests_count'))
-            .group_by(Request.user_id)
-            .limit(5)
-        ).subquery()
+    def get_top_committers(self, limit=5, since=None):
+        '''Get Users with maximum number of requests (since the date, if any) along with the numbers'''
+        return self._get_top_users(User.requests_count, UserDailyStats.requests, limit, since)
 
-        # Return user info
+    def get_best_committers(self, limit=5, since=None):
+        '''
+        Get Users with maximum upvotes on all their requests (the upvotes cast since the date, if any)
+        along with the numbers
+        '''
+        return self._get_top_users(User.upvotes_received, UserDailyStats.upvotes_received, limit, since)
+
+    def _get_top_users(self, counter, daily_counter, limit, since):
+        '''
+        Top-N read of a leaderboard counter, which is served by the index on it.
+        For a time window, the daily totals are summed instead: at most one row per user per day.
+        The top of the sums is taken before joining the users, so only the winners are read
+        (the ties for the last place go to the older accounts).
+        '''
+        s = self.start_session()
+        if since is None:
+            total = counter
+            query = s.query(User, total).filter(total > 0)
+        else:
+            window_total = func.sum(daily_counter)
+            totals = (
+                s.query(UserDailyStats.user_id, window_total.label('total'))
+                .filter(UserDailyStats.day >= since)
+                .group_by(UserDailyStats.user_id)
+                .having(window_total > 0)
+                .order_by(window_total.desc(), UserDailyStats.user_id)
+                .limit(limit)
+                .subquery()
+            )
+            total = totals.c.total
+            query = s.query(User, total).join(totals, totals.c.user_id == User.id)
         return (
-            s.query(
-                User,
-                requests.c.requests_count)
-            .join(requests, User.id == requests.c.user_id)
+            query
             .order_by(
-                requests.c.requests_count.desc(),
+                total.desc(),
                 User.username,
                 User.first_name)
+            .limit(limit)
         )
 
-    def get_best_committers(self):
-        '''Get Users with maximum upvotes on all their requests'''
+    def get_top_categories(self, limit=5, since=None):
+        '''Get Categories with maximum number of requests (since the date, if any) along with the numbers'''
         s = self.start_session()
-
-        # Count upvotes on each request
-        votes = (
-            s.query(
-                Vote.request_id,
-                func.count('*').label('votes_count'))
-            .filter(Vote.upvote == True)
-            .group_by(Vote.request_id)
-        ).subquery()
-
-        # Get a total number of votes on all requests of each user
-        requests = (
-            s.query(
-                Request.user_id,
-                func.sum(votes.c.votes_count).label('votes_sum'))
-            .join(votes, Request.id == votes.c.request_id)
-            .group_by(Request.user_id)
-            .limit(5)
-        ).subquery()
-
-        # Return user info with calculated sum of votes
+        total = func.sum(CategoryDailyStats.requests)
+        query = (
+            s.query(Category, total)
+            .join(CategoryDailyStats, CategoryDailyStats.category_tag == Category.tag)
+        )
+        if since is not None:
+            query = query.filter(CategoryDailyStats.day >= since)
         return (
-            s.query(
-                User,
-                requests.c.votes_sum)
-            .join(requests, User.id == requests.c.user_id)
-            .order_by(
-                requests.c.votes_sum.desc(),
-                User.username,
-                User.first_name)
+            query
+            .group_by(Category.tag)
+            .having(total > 0)
+            .order_by(total.desc(), Category.name)
+            .limit(limit)
         )
 
+    def get_today(self):
+        '''The current date of the database: the day the daily totals are counted under right now'''
+        s = self.start_session()
+        return s.query(func.current_date()).scalar()
+
     def create_invoice(self, user, price, total, currency):
         '''Create Donation and return its id'''
         s = self.start_session()
-        u = self._get_or_add_user(user.id, user.first_name, user.last_name, user.username)
+        user_id = self._upsert_user(user)
         d = Donation(
             id=str(uuid4()),
-            user_id=u.id,
+            user_id=user_id,
             created_on=datetime.now(),
             price=price,
             total=total,
@@ -321,9 +711,13 @@ class DB(object):
         s = self.start_session()
         return s.query(Donation).get(invoice_id)
 
-    def update_invoice(self, invoice_id, tg_charge_id, provider_charge_id):
-        '''Add the missing fields to the invoice'''
+    def update_invoice(self, invoice_id, tg_charge_id, provider_charge_id, update_id=None):
+        '''
+        Add the missing fields to the invoice.
+        With `update_id`, the update is claimed in the same transaction (see `_claim_update`).
+        '''
         s = self.start_session()
+        self._claim_update(update_id)
         invoice: Donation = s.query(Donation).get(invoice_id)
         invoice.paid_on = datetime.now()
         invoice.telegram_charge_id = tg_charge_id
@@ -357,3 +751,38 @@ class DB(object):
                 User.username,
                 User.first_name)
         )
+
+    def enqueue_updates(self, updates):
+        '''Append the (shard, payload) pairs to the inbox with a single statement and commit'''
+        with self.engine.begin() as connection:
+            connection.execute(
+                InboxUpdate.__table__.insert(),
+                [{'shard': shard, 'payload': payload} for shard, payload in updates]
+            )
+
+    def lease_updates(self, shard, limit, lease):
+        '''
+        Take up to `limit` oldest updates of the `shard` from the inbox for `lease` seconds, during which
+        nobody else gets them (nor any other update of the shard). Returns the rows of (id, payload, attempts)
+        ordered by id. The updates which are not acknowledged before the lease expires are handed out again.
+        '''
+        with self.engine.begin() as connection:
+            rows = connection.execute(_LEASE_UPDATES_SQL, shard=shard, limit=limit, lease=lease).fetchall()
+        return sorted(rows, key=lambda row: row.id)
+
+    def ack_updates(self, ids):
+        '''Remove the handled updates from the inbox'''
+        with self.engine.begin() as connection:
+            connection.execute(_ack_updates_statement(ids))
+
+    def get_inbox_depth(self):
+        '''Number of the updates in the inbox per shard'''
+        with self.engine.connect() as connection:
+            return dict(connection.execute(
+                select([InboxUpdate.shard, func.count()]).group_by(InboxUpdate.shard)
+            ).fetchall())
+
+    def prune_processed_updates(self, ttl):
+        '''Forget the updates processed more than `ttl` seconds ago, returns how many were forgotten'''
+        with self.engine.begin() as connection:
+            return connection.execute(_prune_processed_updates_statement(ttl)).rowcount
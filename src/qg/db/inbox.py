@@ -0,0 +1,46 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, Text, func
+
+from .common import Base
+
+
+class InboxUpdate(Base):
+    '''
+    An update received from Telegram but not handled yet, see `qg.bot.inbox`.
+    The updates of a shard are handled in the order of `id`, a row is deleted once handled.
+    '''
+    __tablename__ = 'Inbox'
+    __table_args__ = (
+        # the next batch of a shard
+        Index('ix_Inbox_shard_id', 'shard', 'id'),
+        # whether a batch of a shard is being handled
+        Index('ix_Inbox_shard_leased_until', 'shard', 'leased_until'),
+    )
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    shard = Column(Integer, nullable=False, default=0, server_default='0')
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, nullable=False, server_default=func.now())
+    # the update is being handled by someone till then, it's handed out again afterwards
+    leased_until = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<InboxUpdate(id={self.id}, shard={self.shard}, attempts={self.attempts})>'
+
+
+class ProcessedUpdate(Base):
+    '''
+    An update which has been handled already, so that its redelivery is ignored, see `qg.bot.dedupe`.
+    The rows are kept for as long as Telegram may redeliver the update.
+    '''
+    __tablename__ = 'ProcessedUpdates'
+    __table_args__ = (
+        # the pruning
+        Index('ix_ProcessedUpdates_processed_at', 'processed_at'),
+    )
+
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    processed_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f'<ProcessedUpdate(update_id={self.update_id}, processed_at={self.processed_at})>'
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from qg.logger import logger
+from qg.utils.histogram import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats(object):
+    '''
+    Timing of every SQL statement executed by the engine.
+
+    Keeps a latency histogram per kind of statement (SELECT, INSERT, etc.) and logs
+    the statements which take longer than `slow_query_threshold` seconds.
+    '''
+
+    def __init__(self, engine: Engine, slow_query_threshold=None):
+        self.slow_query_threshold = slow_query_threshold
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(engine, 'handle_error', self._on_error)
+
+    def _histogram(self, kind):
+        if (histogram := self.histograms.get(kind)) is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(kind, Histogram())
+        return histogram
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+        kind = words[0].upper() if (words := statement.split(None, 1)) else 'UNKNOWN'
+        self._histogram(kind).observe(elapsed)
+        self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            logger.warning(f'Slow query ({elapsed * 1000:.0f} ms): {" ".join(statement.split())[:500]}')
+
+    def _on_error(self, context):
+        if context.connection is not None and (start_times := context.connection.info.get('query_start_time')):
+            start_times.pop()
+
+    @property
+    def statements(self) -> int:
+        '''Number of statements executed so far by all the threads'''
+        return sum(histogram.count for histogram in list(self.histograms.values()))
+
+    @property
+    def thread_statements(self) -> int:
+        '''Number of statements executed so far by the current thread'''
+        return getattr(self._local, 'statements', 0)
+
+    def summary(self) -> dict[str, dict]:
+        '''Number of statements, total time and the estimated percentiles per kind of statement'''
+        return {
+            kind: {
+                'count': histogram.count,
+                'total': histogram.sum,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99)
+            }
+            for kind, histogram in list(self.histograms.items())
+        }
@@ -0,0 +1,144 @@
+'''
+Versioned schema migrations.
+
+The version of the schema and a hash of the seed data (the admins and the categories
+from the settings) are kept in a single row of `SchemaVersion`. On startup, that row is
+the only thing read when nothing has changed: no reflection and no seeding.
+
+A brand new database gets the current schema straight away. A database created before
+the migrations were introduced (version 0) goes through all of them, so each of them
+checks what is already there.
+
+To change the schema, add a new module here with `upgrade(connection)` and append it to `MIGRATIONS`.
+'''
+import hashlib
+import json
+
+from qg.logger import logger
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+
+from ..categories import Category
+from ..common import Base
+from ..users import User
+from . import (v001_vote_counters, v002_user_counters, v003_timestamps, v004_rollups, v005_indexes,
+               v006_inbox, v007_processed_updates, v008_vote_changed_at, v009_inbox_leases)
+
+MIGRATIONS = [
+    v001_vote_counters,
+    v002_user_counters,
+    v003_timestamps,
+    v004_rollups,
+    v005_indexes,
+    v006_inbox,
+    v007_processed_updates,
+    v008_vote_changed_at,
+    v009_inbox_leases
+]
+LATEST = len(MIGRATIONS)
+
+# an arbitrary key of the advisory lock which serializes the migrations of several processes
+_LOCK_KEY = 0x7167626f74
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'SchemaVersion'
+
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(Integer, nullable=False)
+    seed_hash = Column(String(64))
+
+    def __repr__(self):
+        return f'<SchemaVersion(version={self.version}, seed_hash={self.seed_hash})>'
+
+
+def seed_hash(admins, categories):
+    seed = {'admins': [dict(admin) for admin in admins], 'categories': [dict(category) for category in categories]}
+    return hashlib.sha256(json.dumps(seed, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read_version(connection):
+    row = connection.execute(SchemaVersion.__table__.select()).first()
+    return (row.version, row.seed_hash) if row is not None else (None, None)
+
+
+def current_version(engine):
+    '''(version, seed hash) of the database, or (None, None) if it has no version yet'''
+    try:
+        with engine.connect() as connection:
+            return _read_version(connection)
+    except DBAPIError:
+        return None, None  # no such table
+
+
+def migrate(db, admins=[], categories=[]):
+    '''
+    Bring the schema to the latest version and the seed data in line with the settings.
+    Returns True if anything had to be done.
+    '''
+    expected_hash = seed_hash(admins, categories)
+    if current_version(db.engine) == (LATEST, expected_hash):
+        logger.info(f'The database schema is up to date (version {LATEST}).')
+        return False
+
+    recount = False
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # the migrations (and the wait for the lock) take as long as the data requires
+            connection.execute('SET LOCAL statement_timeout = 0')
+            connection.execute(f'SELECT pg_advisory_xact_lock({_LOCK_KEY})')
+
+        # someone else could have done the job while we were waiting for the lock
+        if connection.dialect.has_table(connection, SchemaVersion.__tablename__):
+            version, stored_hash = _read_version(connection)
+        else:
+            version, stored_hash = None, None
+
+        if version is None:
+            if connection.dialect.has_table(connection, User.__tablename__):
+                logger.info('The database was created before the migrations were introduced.')
+                version = 0
+            else:
+                logger.info('Creating the database schema…')
+                Base.metadata.create_all(connection)
+                version = LATEST
+            SchemaVersion.__table__.create(connection, checkfirst=True)
+            connection.execute(SchemaVersion.__table__.insert().values(id=1, version=version))
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f'Migrating the database schema to version {number}: {migration.__doc__.strip()}')
+            migration.upgrade(connection)
+            recount = recount or getattr(migration, 'RECOUNT', False)
+
+        if stored_hash != expected_hash:
+            logger.info('Seeding the admins and the categories…')
+            _seed(connection, admins, categories)
+
+        connection.execute(SchemaVersion.__table__.update().values(version=LATEST, seed_hash=expected_hash))
+
+    if recount:
+        with db.session():
+            db.recount_votes()
+    logger.success('Done.')
+    return True
+
+
+def _seed(connection, admins, categories):
+    '''Upsert all the admins and all the categories with a statement per set of the fields they provide'''
+    _upsert(connection, User, User.id, [dict(admin) | {'is_admin': True} for admin in admins])
+    _upsert(connection, Category, Category.tag, [dict(category) for category in categories])
+
+
+def _upsert(connection, model, key, rows):
+    '''Only the fields a row provides are written, the rest of an existing row stays as it is'''
+    groups = {}
+    for row in rows:
+        groups.setdefault(frozenset(row), []).append(row)
+
+    for columns, group in groups.items():
+        statement = insert(model).values(group)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: getattr(statement.excluded, column) for column in columns - {key.key}}
+        ))
@@ -0,0 +1,16 @@
+'''The vote counters of the requests'''
+from sqlalchemy import inspect
+
+from ..requests import Request
+
+RECOUNT = True
+
+
+def upgrade(connection):
+    if 'upvotes' in {c['name'] for c in inspect(connection).get_columns(Request.__tablename__)}:
+        return
+    connection.execute(
+        f'ALTER TABLE "{Request.__tablename__}" '
+        'ADD COLUMN upvotes INTEGER NOT NULL DEFAULT 0, '
+        'ADD COLUMN downvotes INTEGER NOT NULL DEFAULT 0'
+    )
@@ -0,0 +1,18 @@
+'''The leaderboard counters of the users'''
+from sqlalchemy import inspect
+
+from ..users import User
+
+RECOUNT = True
+
+
+def upgrade(connection):
+    if 'requests_count' in {c['name'] for c in inspect(connection).get_columns(User.__tablename__)}:
+        return
+    connection.execute(
+        f'ALTER TABLE "{User.__tablename__}" ' +
+        ', '.join(
+            f'ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'
+            for column in ('requests_count', 'votes_count', 'upvotes_received')
+        )
+    )
@@ -0,0 +1,17 @@
+'''The timestamps of the requests and the votes'''
+from sqlalchemy import inspect
+
+from ..requests import Request
+from ..votes import Vote
+
+RECOUNT = True
+
+
+def upgrade(connection):
+    # the older requests and votes are all dated by the time of the upgrade
+    inspector = inspect(connection)
+    for table in (Request, Vote):
+        if 'created_at' not in {c['name'] for c in inspector.get_columns(table.__tablename__)}:
+            connection.execute(
+                f'ALTER TABLE "{table.__tablename__}" ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT now()'
+            )
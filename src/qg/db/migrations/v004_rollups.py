@@ -0,0 +1,10 @@
+'''The daily totals of the users and the categories'''
+from ..rollups import CategoryDailyStats, UserDailyStats
+
+# filled in by the recount
+RECOUNT = True
+
+
+def upgrade(connection):
+    UserDailyStats.__table__.create(connection, checkfirst=True)
+    CategoryDailyStats.__table__.create(connection, checkfirst=True)
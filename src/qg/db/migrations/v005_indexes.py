@@ -0,0 +1,16 @@
+'''The indexes of the hot queries and the leaderboards'''
+from sqlalchemy import inspect
+
+from ..common import Base
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
@@ -0,0 +1,6 @@
+'''The durable queue of the received updates'''
+from ..inbox import InboxUpdate
+
+
+def upgrade(connection):
+    InboxUpdate.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,6 @@
+'''The ids of the recently handled updates'''
+from ..inbox import ProcessedUpdate
+
+
+def upgrade(connection):
+    ProcessedUpdate.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,13 @@
+'''The time the votes took their current sides, which the voting messages are ordered by'''
+from sqlalchemy import inspect
+
+from ..votes import Vote
+
+
+def upgrade(connection):
+    # the votes haven't been switched before, so they took their sides when they were cast
+    if 'changed_at' not in {c['name'] for c in inspect(connection).get_columns(Vote.__tablename__)}:
+        connection.execute(
+            f'ALTER TABLE "{Vote.__tablename__}" ADD COLUMN changed_at TIMESTAMP NOT NULL DEFAULT now()'
+        )
+        connection.execute(f'UPDATE "{Vote.__tablename__}" SET changed_at = created_at')
@@ -0,0 +1,11 @@
+'''The index of the leased batches of the inbox'''
+from sqlalchemy import inspect
+
+from ..inbox import InboxUpdate
+
+
+def upgrade(connection):
+    existing = {index['name'] for index in inspect(connection).get_indexes(InboxUpdate.__tablename__)}
+    for index in InboxUpdate.__table__.indexes:
+        if index.name not in existing:
+            index.create(connection)
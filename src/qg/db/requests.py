@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, Index, Integer, String, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 
@@ -7,11 +7,19 @@ from .common import CATEGORY_TAG_MAX_LEN, Base
 
 class Request(Base):
     __tablename__ = 'Requests'
+    __table_args__ = (
+        Index('ix_Requests_user_id', 'user_id'),
+        # nullifying the requests of a removed category
+        Index('ix_Requests_category_tag', 'category_tag'),
+    )
 
     id = Column(String(256), primary_key=True)
     user_id = Column(Integer, ForeignKey('Users.id'))
     category_tag = Column(String(CATEGORY_TAG_MAX_LEN), ForeignKey('Categories.tag'))
     text = Column(String, nullable=False)
+    upvotes = Column(Integer, nullable=False, default=0, server_default='0')
+    downvotes = Column(Integer, nullable=False, default=0, server_default='0')
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
 
     user = relationship('User', back_populates='requests')
     votes = relationship('Vote', back_populates='request',
@@ -19,4 +27,5 @@ class Request(Base):
                                  passive_deletes=True)
 
     def __repr__(self):
-        return f'<Request(id={self.id}, user_id={self.user_id}, category_tag={self.category_tag}, text={self.text})>'
+        return f'<Request(id={self.id}, user_id={self.user_id}, category_tag={self.category_tag}, text={self.text}, ' \
+               f'upvotes={self.upvotes}, downvotes={self.downvotes})>'
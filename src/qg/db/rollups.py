@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Date, Integer, String
+from sqlalchemy.sql.schema import ForeignKey
+
+from .common import CATEGORY_TAG_MAX_LEN, Base
+
+
+class UserDailyStats(Base):
+    '''
+    Per-day totals of a single User, so that the leaderboards over a time window sum
+    one row per day instead of scanning the raw requests and votes.
+    The votes are accounted on the day they were cast, even if changed or revoked later.
+    '''
+    __tablename__ = 'UserDailyStats'
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey('Users.id'), primary_key=True)
+    requests = Column(Integer, nullable=False, default=0, server_default='0')
+    votes = Column(Integer, nullable=False, default=0, server_default='0')
+    upvotes_received = Column(Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<UserDailyStats(day={self.day}, user_id={self.user_id}, requests={self.requests}, ' \
+               f'votes={self.votes}, upvotes_received={self.upvotes_received})>'
+
+
+class CategoryDailyStats(Base):
+    '''Per-day totals of a single Category, see `UserDailyStats`'''
+    __tablename__ = 'CategoryDailyStats'
+
+    day = Column(Date, primary_key=True)
+    category_tag = Column(String(CATEGORY_TAG_MAX_LEN), ForeignKey('Categories.tag', ondelete='CASCADE'), primary_key=True)
+    requests = Column(Integer, nullable=False, default=0, server_default='0')
+    upvotes = Column(Integer, nullable=False, default=0, server_default='0')
+    downvotes = Column(Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<CategoryDailyStats(day={self.day}, category_tag={self.category_tag}, requests={self.requests}, ' \
+               f'upvotes={self.upvotes}, downvotes={self.downvotes})>'
@@ -1,12 +1,27 @@
 from qg.utils.helpers import mention_md
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import Boolean, Column, Index, Integer, String, text
 from sqlalchemy.orm import relationship
 
 from .common import Base
 
 
+def display_name(username, first_name, last_name=None):
+    '''@username if there is one, full name otherwise'''
+    if username is not None and username != '':
+        return f'@{username}'
+    else:
+        name = first_name
+        if last_name is not None and last_name != '':
+            name += f' {last_name}'
+        return name
+
+
 class User(Base):
     __tablename__ = 'Users'
+    __table_args__ = (
+        # the few admins in the order of `DB.get_admins`
+        Index('ix_Users_admins', 'first_name', 'username', postgresql_where=text('is_admin')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=False)
     first_name = Column(String, nullable=False)
@@ -14,8 +29,14 @@ class User(Base):
     username = Column(String, unique=True)
     is_admin = Column(Boolean, default=False)
 
-    requests = relationship('Request', back_populates='user')
-    votes = relationship('Vote', back_populates='user')
+    # leaderboard counters, maintained along with the requests and the votes (see `DB.recount_votes`)
+    requests_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+    votes_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+    upvotes_received = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+
+    # these are never needed in the hot paths, so loading them accidentally is an error
+    requests = relationship('Request', back_populates='user', lazy='raise')
+    votes = relationship('Vote', back_populates='user', lazy='raise')
     donations = relationship('Donation', back_populates='user')
 
     def __repr__(self):
@@ -23,13 +44,7 @@ class User(Base):
                f'username="{self.username}", is_admin={self.is_admin})>'
 
     def username_or_name(self):
-        if self.username is not None and self.username != '':
-            return f'@{self.username}'
-        else:
-            name = self.first_name
-            if self.last_name is not None and self.last_name != '':
-                name += f' {self.last_name}'
-            return name
+        return display_name(self.username, self.first_name, self.last_name)
 
     def username_or_id_and_name(self):
         if self.username is not None and self.username != '':
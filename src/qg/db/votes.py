@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 
@@ -7,13 +7,20 @@ from .common import Base
 
 class Vote(Base):
     __tablename__ = 'Votes'
+    __table_args__ = (
+        # the votes of a user (the primary key starts with the request)
+        Index('ix_Votes_user_id', 'user_id'),
+    )
 
     request_id = Column(String(256), ForeignKey('Requests.id'), primary_key=True)
     user_id = Column(Integer, ForeignKey('Users.id'), primary_key=True)
     upvote = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    # when the vote took its current side, the voters are listed in this order (see `qg.bot.render`)
+    changed_at = Column(DateTime, nullable=False, server_default=func.now())
 
     request = relationship('Request', back_populates='votes')
-    user = relationship('User', back_populates='votes')
+    user = relationship('User', back_populates='votes', lazy='raise')
 
     def __repr__(self):
         return f'<Vote(request_id={self.request_id}, user_id={self.user_id}, upvote?={self.upvote})>'
@@ -1,4 +1,6 @@
+import itertools
 import logging
+import sys
 
 from loguru import logger
 
@@ -21,3 +23,52 @@ class InterceptHandler(logging.Handler):
 
 
 logging.basicConfig(handlers=[InterceptHandler()], level=0)
+
+_sampling = {}
+_counters = {}
+
+
+def configure(filename=None, console_level='INFO', file_level='DEBUG', enqueue=True, sampling=None):
+    '''
+    Replace the sinks of the logger with the console and the (rotated) file ones.
+
+    With `enqueue`, the records are passed to the sinks through a queue and written, rotated and
+    compressed by a background thread, so the handlers only pay for putting a record into the queue.
+    The messages below the lowest of the levels are dropped before they are formatted (both here
+    and in the standard `logging`), see also `logger.opt(lazy=True)` for the expensive arguments.
+
+    `sampling` maps the kinds of messages to N, so that only one of every N is logged, see `sampled`.
+    '''
+    logger.remove()
+    levels = [logger.level(console_level).no]
+    if filename:
+        logger.add(filename, level=file_level, rotation='10 MB', compression='zip', enqueue=enqueue)
+        levels.append(logger.level(file_level).no)
+    logger.add(
+        sys.stderr,
+        level=console_level,
+        colorize=True,
+        backtrace=True,
+        diagnose=True,
+        enqueue=enqueue)
+    logging.getLogger().setLevel(min(levels))
+
+    _sampling.clear()
+    _sampling.update(sampling or {})
+    _counters.clear()
+
+
+def sampled(kind: str) -> bool:
+    '''
+    Whether to log this message of the given kind: true for one of every N calls, where N is
+    configured by `configure(sampling=...)`, and for every call of the kinds with no N configured.
+
+        if sampled('vote'):
+            logger.debug('Vote on "{}"', message_id)
+    '''
+    if (every := _sampling.get(kind, 1)) <= 1:
+        return True
+    if (counter := _counters.get(kind)) is None:
+        counter = _counters.setdefault(kind, itertools.count())
+    # next() of itertools.count is atomic, no lock is needed
+    return next(counter) % every == 0
@@ -0,0 +1,51 @@
+import bisect
+import threading
+
+# seconds, from 1 ms to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    '''A thread-safe histogram of observed values with fixed bucket bounds'''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is for the values above all bounds
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        '''Pairs of (upper bound, number of values not greater than it), the last bound is infinity'''
+        with self._lock:
+            counts = list(self._counts)
+        result, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        '''Estimate of the q-quantile: the upper bound of the bucket it falls into'''
+        cumulative = self.cumulative()
+        if (total := cumulative[-1][1]) == 0:
+            return 0.0
+        rank = q * total
+        for bound, count in cumulative:
+            if count >= rank:
+                return bound
+        return cumulative[-1][0]
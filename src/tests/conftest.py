@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from qg.db import DB
+
+
+@pytest.fixture(scope='session')
+def postgres():
+    '''The Postgres database in QG_TEST_DB_URI with the current schema, the tests using it are skipped without one'''
+    if not (uri := os.environ.get('QG_TEST_DB_URI')):
+        pytest.skip('QG_TEST_DB_URI is not set')
+    db = DB(full_uri=uri)
+    db.create_all(categories=[{'tag': 'test', 'name': 'Test', 'url': ''}])
+    return db
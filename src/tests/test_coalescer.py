@@ -0,0 +1,91 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from qg.bot.coalescer import EditCoalescer
+from qg.bot.concurrency import SerialExecutor
+from qg.bot.outbox import Outbox
+
+
+class FakeJobQueue(object):
+    '''Keeps the jobs until they are run explicitly'''
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, context=None):
+        self.jobs.append((callback, context))
+
+    def run_all(self, bot):
+        jobs, self.jobs = self.jobs, []
+        for callback, context in jobs:
+            callback(SimpleNamespace(job=SimpleNamespace(context=context), bot=bot))
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.edits = []
+
+    def edit_message_text(self, **kwargs):
+        self.edits.append(kwargs)
+
+
+@pytest.fixture
+def coalescer():
+    outbox = Outbox(workers=1, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    executor = SerialExecutor(workers=2)
+    coalescer = EditCoalescer(FakeJobQueue(), outbox, executor, delay=0.1)
+    yield coalescer
+    executor.shutdown()
+    outbox.stop()
+
+
+def state(text):
+    return {'text': text, 'reply_markup': InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data='up')]])}
+
+
+def flush(coalescer, bot):
+    coalescer.job_queue.run_all(bot)
+    coalescer.executor.join()
+    coalescer.outbox.stop()
+
+
+def test_edits_within_the_window_are_merged(coalescer):
+    bot = FakeBot()
+    for i in range(50):
+        coalescer.edit('message', lambda i=i: state(f'vote {i}'))
+
+    assert len(coalescer.job_queue.jobs) == 1
+    flush(coalescer, bot)
+
+    assert [edit['text'] for edit in bot.edits] == ['vote 49']
+    assert bot.edits[0]['inline_message_id'] == 'message'
+
+
+def test_unchanged_message_isnt_edited(coalescer):
+    bot = FakeBot()
+    coalescer.edit('message', lambda: state('same'))
+    coalescer.job_queue.run_all(bot)
+    coalescer.executor.join()
+    coalescer.outbox.call(lambda: None, rate_key='message')  # waits for the edit to be sent
+
+    coalescer.edit('message', lambda: state('same'))
+    flush(coalescer, bot)
+
+    assert len(bot.edits) == 1
+
+
+def test_message_is_rendered_off_the_job_queue(coalescer):
+    bot = FakeBot()
+    threads = []
+
+    def render():
+        threads.append(threading.current_thread())
+        return state('text')
+
+    coalescer.edit('message', render)
+    flush(coalescer, bot)
+
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
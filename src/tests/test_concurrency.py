@@ -0,0 +1,92 @@
+import threading
+import time
+
+from qg.bot.concurrency import SerialExecutor
+
+
+def test_same_key_runs_in_order_one_at_a_time():
+    executor = SerialExecutor(workers=4)
+    done = {'a': [], 'b': []}
+    running = {'a': 0, 'b': 0}
+    overlaps = []
+    lock = threading.Lock()
+
+    def task(key, i):
+        with lock:
+            running[key] += 1
+            if running[key] > 1:
+                overlaps.append((key, i))
+        time.sleep(0.001)
+        with lock:
+            running[key] -= 1
+            done[key].append(i)
+
+    for i in range(50):
+        executor.submit('a', task, 'a', i)
+        executor.submit('b', task, 'b', i)
+    executor.join()
+    executor.shutdown()
+
+    assert done == {'a': list(range(50)), 'b': list(range(50))}
+    assert overlaps == []
+
+
+def test_different_keys_run_in_parallel():
+    executor = SerialExecutor(workers=2)
+    barrier = threading.Barrier(2, timeout=5)
+
+    # each task waits for the other one, so they only finish if they run at the same time
+    executor.submit('a', barrier.wait)
+    executor.submit('b', barrier.wait)
+    executor.join()
+    executor.shutdown()
+
+    assert not barrier.broken
+
+
+def test_no_workers_runs_in_the_calling_thread():
+    executor = SerialExecutor(workers=0)
+    threads = []
+
+    executor.submit('a', lambda: threads.append(threading.current_thread()))
+
+    assert threads == [threading.current_thread()]
+    assert executor.pending == 0
+
+
+def test_failed_task_doesnt_stop_the_key():
+    executor = SerialExecutor(workers=2)
+    done = []
+
+    def fail():
+        raise ValueError('expected')
+
+    executor.submit('a', fail)
+    executor.submit('a', done.append, 1)
+    executor.submit(None, done.append, 2)
+    executor.join()
+    executor.shutdown()
+
+    assert sorted(done) == [1, 2]
+    assert executor.pending == 0 and executor.busy == 0
+
+
+def test_wrap():
+    executor = SerialExecutor(workers=1)
+    calls = []
+
+    def wrap(fn):
+        def wrapped(*args):
+            calls.append(fn.__name__)
+            return fn(*args)
+        return wrapped
+
+    def task():
+        pass
+
+    executor.wrap = wrap
+    executor.submit('a', task)
+    executor.join()
+    executor.shutdown()
+
+    assert calls == ['task']
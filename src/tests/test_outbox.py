@@ -0,0 +1,179 @@
+import threading
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from qg.bot.outbox import Outbox, Priority, TokenBucket
+
+
+@pytest.fixture
+def outbox():
+    # fast enough not to slow the tests down, unless a test asks for its own limits
+    outbox = Outbox(workers=4, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    yield outbox
+    outbox.stop()
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take(now)
+
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    assert not bucket.idle(now + 0.5)
+    assert bucket.idle(now + 1.5)
+
+
+def test_bucket_block():
+    bucket = TokenBucket(rate=1, capacity=1)
+    now = bucket.updated_at
+
+    bucket.block(now, 5)
+    bucket.block(now, 1)
+
+    assert bucket.delay(now) == pytest.approx(5)
+    assert bucket.delay(now + 5) == 0
+
+
+def test_calls_of_a_chat_are_made_in_order_one_at_a_time(outbox):
+    made = []
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def call(chat_id, i):
+        with lock:
+            if chat_id in running:
+                overlaps.append((chat_id, i))
+            running.append(chat_id)
+        time.sleep(0.001)
+        with lock:
+            running.remove(chat_id)
+            made.append((chat_id, i))
+
+    futures = [outbox.submit(call, chat_id, i, rate_key=chat_id) for i in range(30) for chat_id in (1, 2)]
+    for future in futures:
+        future.result(timeout=5)
+
+    assert [i for chat_id, i in made if chat_id == 1] == list(range(30))
+    assert [i for chat_id, i in made if chat_id == 2] == list(range(30))
+    assert overlaps == []
+
+
+def test_postponed_call_isnt_overtaken(outbox):
+    made = []
+    failures = [RetryAfter(0.05)]
+
+    def call(i):
+        if i == 0 and failures:
+            raise failures.pop()
+        made.append(i)
+        return i
+
+    futures = [outbox.submit(call, i, rate_key='chat') for i in range(3)]
+
+    assert [future.result(timeout=5) for future in futures] == [0, 1, 2]
+    assert made == [0, 1, 2]
+
+
+def test_postponed_answer_doesnt_hold_up_the_others(outbox):
+    made = {}
+    failures = [RetryAfter(0.3)]
+
+    def answer():
+        made.setdefault('answer', []).append(time.monotonic())
+        if failures:
+            raise failures.pop()
+
+    started = time.monotonic()
+    answered = outbox.submit(answer, priority=Priority.URGENT)
+    time.sleep(0.05)
+    sent = [outbox.submit(lambda chat_id: made.setdefault(chat_id, time.monotonic()), chat_id, rate_key=chat_id)
+            for chat_id in (1, 2)]
+    for future in [answered] + sent:
+        future.result(timeout=5)
+
+    first, retry = made['answer']
+    assert retry - first >= 0.3
+    assert made[1] - started < 0.2 and made[2] - started < 0.2
+
+
+def test_retries_are_limited():
+    outbox = Outbox(workers=1, global_rate=1000, chat_rate=1000, chat_burst=1000, max_retries=2)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise RetryAfter(0)
+
+    future = outbox.submit(call, rate_key='chat')
+
+    with pytest.raises(RetryAfter):
+        future.result(timeout=5)
+    assert len(attempts) == 3
+    outbox.stop()
+
+
+def test_higher_priority_goes_first():
+    outbox = Outbox(workers=1, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    made = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    outbox.submit(block)
+    started.wait(5)
+    futures = [
+        outbox.submit(made.append, 'low', priority=Priority.LOW),
+        outbox.submit(made.append, 'normal'),
+        outbox.submit(made.append, 'urgent', priority=Priority.URGENT),
+    ]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+    assert made == ['urgent', 'normal', 'low']
+    outbox.stop()
+
+
+def test_urgent_answers_are_exempt_from_the_global_limit():
+    outbox = Outbox(workers=2, global_rate=1, chat_rate=1000, chat_burst=1000)
+    outbox.call(lambda: None)  # the only token of the global bucket
+
+    started = time.monotonic()
+    for _ in range(5):
+        outbox.call(lambda: None, priority=Priority.URGENT)
+
+    assert time.monotonic() - started < 0.5
+    outbox.stop(timeout=0)
+
+
+def test_stop_makes_the_queued_calls():
+    outbox = Outbox(workers=1, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    futures = [outbox.submit(time.sleep, 0.001, rate_key='chat') for _ in range(20)]
+
+    outbox.stop()
+
+    assert all(future.done() and future.exception() is None for future in futures)
+
+
+def test_stop_fails_the_calls_left_after_the_timeout():
+    outbox = Outbox(workers=1, global_rate=1000, chat_rate=0.1, chat_burst=1)
+    futures = [outbox.submit(lambda: None, rate_key='chat') for _ in range(3)]
+
+    outbox.stop(timeout=0.1)
+
+    assert futures[0].result(timeout=0) is None
+    for future in futures[1:]:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=0)
+    with pytest.raises(RuntimeError):
+        outbox.submit(lambda: None).result(timeout=0)
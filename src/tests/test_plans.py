@@ -0,0 +1,5 @@
+from qg.db.plans import check
+
+
+def test_hot_queries_use_indexes(postgres):
+    assert check(postgres) == []
@@ -0,0 +1,197 @@
+import re
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from uuid import uuid4
+
+from qg.bot.render import MESSAGE_LIMIT, VoteRenderer, _VoteMessage, _Voters
+from qg.db.db import VoteToggle
+
+
+def voters(count, prefix='✅: '):
+    v = _Voters(prefix)
+    for user_id in range(count):
+        v.add(user_id, f'voter{user_id}')
+    return v
+
+
+def test_voters_fit():
+    v = voters(3)
+
+    assert v.render(1000) == '✅: voter0, voter1, voter2\n'
+    assert len(v.render(1000)) == v.size()
+
+
+def test_voters_keep_the_order_of_voting():
+    v = voters(3)
+    v.add(0, 'voter0')
+    v.remove(1)
+
+    assert v.render(1000) == '✅: voter2, voter0\n'
+
+
+def test_voters_truncated():
+    v = voters(100)
+
+    line = v.render(60)
+
+    assert len(line) <= 60
+    shown, more = re.fullmatch(r'✅: (.*), and (\d+) more\n', line).groups()
+    assert shown.split(', ') == [f'voter{i}' for i in range(100 - int(more))]
+
+
+def test_voters_nothing_fits():
+    assert voters(100).render(10) == '✅: 100 voters\n'
+    assert voters(0).render(10) == ''
+
+
+def test_message_never_exceeds_the_limit():
+    message = _VoteMessage('header', 3000, 3000)
+    for user_id in range(3000):
+        message.vote(user_id, f'[voter{user_id}](tg://user?id={user_id})', user_id % 3 != 0)
+
+    text = message.render()
+
+    assert len(text) <= MESSAGE_LIMIT
+    assert text.startswith('header\n\n*Votes:*\n✅: ')
+    assert re.search(r'and \d+ more\n❌: ', text)
+    assert text.endswith(' more\n')
+
+
+def test_short_side_gives_its_budget_to_the_other():
+    message = _VoteMessage('header', 1000, 1)
+    message.vote(-1, 'downvoter', False)
+    for user_id in range(1000):
+        message.vote(user_id, f'upvoter{user_id}', True)
+
+    text = message.render()
+
+    assert len(text) <= MESSAGE_LIMIT
+    assert len(text) > MESSAGE_LIMIT - 50
+    assert text.endswith('❌: downvoter\n')
+
+
+def test_revoke():
+    message = _VoteMessage('header', 0, 0)
+    message.vote(1, 'voter', True)
+    message.vote(1, 'voter', False)
+    assert message.render() == 'header\n\n*Votes:*\n❌: voter\n'
+
+    message.vote(1, 'voter', None)
+    assert message.render() == 'header'
+
+
+class FakeDB(object):
+    def __init__(self, votes):
+        self.votes = votes
+        self.loads = 0
+        self.loading = threading.Event()
+        self.resume = threading.Event()
+        self.resume.set()
+
+    @contextmanager
+    def session(self):
+        yield
+
+    def get_request(self, request_id):
+        self.loads += 1
+        self.loading.set()
+        self.resume.wait(5)
+        up = sum(1 for v in self.votes if v.upvote)
+        return SimpleNamespace(category_tag='tag', text='text', upvotes=up, downvotes=len(self.votes) - up)
+
+    def get_voter_mentions(self, request_id):
+        return list(self.votes)
+
+    def toggle_vote(self, user_id, upvote):
+        '''Like `DB.toggle_vote`, the votes are kept in the order they took their sides'''
+        previous = next((v for v in self.votes if v.user_id == user_id), None)
+        if previous is not None:
+            self.votes.remove(previous)
+        if previous is None or previous.upvote != upvote:
+            self.votes.append(vote(user_id, upvote))
+        up = sum(1 for v in self.votes if v.upvote)
+        return VoteToggle(
+            upvote=None if previous is not None and previous.upvote == upvote else upvote,
+            upvotes=up, downvotes=len(self.votes) - up, category_tag='tag', text='text'
+        )
+
+
+def vote(user_id, upvote):
+    return SimpleNamespace(user_id=user_id, username=None, first_name=f'user{user_id}', last_name=None, upvote=upvote)
+
+
+def user(user_id):
+    return SimpleNamespace(id=user_id, username=None, first_name=f'user{user_id}', last_name=None)
+
+
+def test_renderer_caches_and_applies():
+    db = FakeDB([vote(1, True)])
+    renderer = VoteRenderer(db)
+
+    text, up, down = renderer.render('request')
+    assert (up, down) == (1, 0)
+    assert 'user1' in text
+
+    renderer.apply('request', user(2), VoteToggle(upvote=False, upvotes=1, downvotes=1, category_tag='tag', text='text'))
+    text, up, down = renderer.render('request')
+
+    assert db.loads == 1
+    assert (up, down) == (1, 1)
+    assert '❌: [user2]' in text
+
+
+def test_vote_applied_while_loading_is_replayed():
+    db = FakeDB([vote(1, True)])
+    db.resume.clear()
+    renderer = VoteRenderer(db)
+    result = []
+
+    thread = threading.Thread(target=lambda: result.append(renderer.render('request')))
+    thread.start()
+    db.loading.wait(5)
+    # the vote is committed after the load has read the request, but isn't seen by the load
+    renderer.apply('request', user(2), VoteToggle(upvote=True, upvotes=2, downvotes=0, category_tag='tag', text='text'))
+    db.resume.set()
+    thread.join(5)
+
+    text, up, down = result[0]
+    assert (up, down) == (2, 0)
+    assert 'user1' in text and 'user2' in text
+
+
+# the second vote of the user 1 switches it, the one of the user 4 revokes it
+VOTES = [(1, True), (2, True), (3, False), (4, False), (1, False), (5, True), (4, False)]
+
+
+def test_reloaded_message_is_the_same():
+    db = FakeDB([])
+    renderer = VoteRenderer(db)
+    renderer.render('request')
+    for user_id, upvote in VOTES:
+        renderer.apply('request', user(user_id), db.toggle_vote(user_id, upvote))
+
+    rendered = renderer.render('request')
+    renderer.forget('request')
+
+    assert renderer.render('request') == rendered
+    assert db.loads == 2
+    assert rendered[0].endswith('✅: [user2](tg://user?id=2), [user5](tg://user?id=5)\n'
+                                '❌: [user3](tg://user?id=3), [user1](tg://user?id=1)\n')
+
+
+def test_reloaded_message_is_the_same_in_postgres(postgres):
+    request_id = f'test-{uuid4()}'
+    with postgres.session():
+        postgres.add_request(request_id, user(1000), 'test', 'text')
+    renderer = VoteRenderer(postgres)
+    renderer.render(request_id)
+    for user_id, upvote in VOTES:
+        with postgres.session():
+            result = postgres.toggle_vote(request_id, user(1000 + user_id), upvote)
+        renderer.apply(request_id, user(1000 + user_id), result)
+
+    rendered = renderer.render(request_id)
+    renderer.forget(request_id)
+
+    assert renderer.render(request_id) == rendered